@@ -4,5 +4,20 @@
 from .adsorbates_operations import fix_adsorbate_id, regenerate_adsorbates
 from .adsorbents_operations import fix_adsorbent_id, regenerate_adsorbents
 from .bibliography_operations import regenerate_bibliography, fix_journal, extract_names, generate_bibliography
-from .isotherm_operations import regenerate_isotherm_library, download_isotherm, post_process, default_adsorption_units
-from .config import doi_stub_rules, pressure_units, canonical_keys, json_writer, clean_json, doi_stub_generator
+from .isotherm_operations import regenerate_isotherm_library, download_isotherm, post_process, \
+    default_adsorption_units, post_process_batch, sync_library
+from .scheduler import regenerate_all
+from .validation import validate
+from .units import UnitRegistry, unit_registry
+from .doi_index import DoiIndex
+from .normalizer import IsothermNormalizer, isotherm_normalizer
+from .library_index import LibraryIndex, index_library, query_library
+from .columnar import export_columnar, load_columnar
+from .interpolation import IsothermBatch, query_uptake
+from .duplicates import find_duplicates
+from .isotherm import Isotherm, load_isotherms
+from .standin import StandinServer, synthetic_dataset
+from .benchmark import run_benchmark
+from .config import doi_stub_rules, pressure_units, adsorption_units, canonical_keys, json_writer, clean_json, \
+    doi_stub_generator, clean_json_tree
+from .reference_maps import refresh_maps
@@ -2,39 +2,67 @@
 """Module to provide operations related to adsorbate objects
 """
 import os
-import json
-import time
 import copy
-import requests
 
-from .config import API_HOST, HEADERS, JSON_FOLDER, json_writer, TRACKER_SUFFIX
+from .config import JSON_FOLDER, json_writer, API_RATE_LIMIT, API_WORKERS
+from .http_client import api_url, get_json, not_found
+from .throttle import make_limiter
+from .manifest import DownloadManifest, run_resumable
+from .streaming import ListingStream
+from .resolver import NameResolver
+
+
+def lookup_adsorbate(name):
+    """Resolve an adsorbate name with the ISODB API (None if unknown)
+
+    Raises ValueError if the API answers with a body that is not JSON.
+    """
+    # Disable API usage tracking
+    url = api_url('/isodb/api/gas/', name.lower(), api_tracking=False)
+    try:
+        gas_info = get_json(url)
+    except OSError as error_handler:
+        # Only a genuine not-found is an unknown name; other errors (5xx,
+        # 429, connection, ...) propagate, so the resolver does not cache them
+        if not_found(error_handler):
+            return None
+        raise
+    return {'InChIKey': gas_info['InChIKey'], 'name': gas_info['name']}
+
+
+ADSORBATE_RESOLVER = NameResolver('adsorbate', lookup_adsorbate)
 
 
 def fix_adsorbate_id(adsorbate_input):
     """Lookup InChIKey from name"""
     output = copy.deepcopy(adsorbate_input)
-    gas_name = adsorbate_input['name'].lower().replace(' ', '%20')
-    # Disable API usage tracking
-    url = API_HOST + '/isodb/api/gas/' + gas_name + '.json&k=dontrackmeplease'
-    # Attempt to resolve the name using the ISODB API
+    # Attempt to resolve the name using the (cached) ISODB API
     try:
-        gas_info = json.loads(requests.get(url, headers=HEADERS).content)
-        output['InChIKey'] = gas_info['InChIKey']
-        output['name'] = gas_info['name']
-        check = True
+        gas_info = ADSORBATE_RESOLVER.resolve(adsorbate_input['name'])
     except ValueError:
-        check = False
-    return output, check
+        # Not a JSON answer: unknown for now, but not cached by the resolver
+        return output, False
+    if gas_info is None:
+        return output, False
+    output['InChIKey'] = gas_info['InChIKey']
+    output['name'] = gas_info['name']
+    return output, True
 
 
-def regenerate_adsorbates(api_tracking=True):
-    """Generate the entire ISODB library from the API"""
-    # Set or disable API usage tracking
-    if api_tracking:
-        url_suffix = ''
-    else:
-        url_suffix = TRACKER_SUFFIX
+def download_adsorbate(task):
+    """Download one adsorbate to the Adsorbates folder"""
+    url, filename = task
+    adsorbate_data = get_json(url)
+    # Write to JSON
+    json_writer(filename, adsorbate_data)
+
 
+def adsorbate_tasks(api_tracking=True, limiter=None):
+    """Listing of the ISODB adsorbates and the download tasks it feeds
+
+    Returns the ListingStream and a generator of (url, filename) tasks for
+    download_adsorbate, queued as the listing is decoded.
+    """
     # Create the JSON Library folder if necessary
     if not os.path.exists(JSON_FOLDER):
         os.mkdir(JSON_FOLDER)
@@ -45,23 +73,37 @@ def regenerate_adsorbates(api_tracking=True):
         os.mkdir(adsorbate_folder)
 
     # Generate a list of adsorbents from the MATDB API
-    url = API_HOST + '/isodb/api/gases.json' + url_suffix
-    adsorbates = json.loads(requests.get(url, headers=HEADERS).content)
-    print(len(adsorbates), 'Adsorbate Species Entries')
+    if limiter is not None:
+        limiter.acquire()
+    url = api_url('/isodb/api/gases.json', api_tracking=api_tracking)
+    adsorbates = ListingStream(url)
 
     # Extract each adsorbate in full form
-    for (adsorbate_count, adsorbate) in enumerate(adsorbates):
-        filename = adsorbate['InChIKey'] + '.json'
-        url = API_HOST + '/isodb/api/gas/' + filename + url_suffix
-        print(url)
-        try:
-            adsorbate_data = json.loads(
-                requests.get(url, headers=HEADERS).content)
-            # pprint.pprint(adsorbate_data)
-            # Write to JSON
-            json_writer(adsorbate_folder + '/' + filename, adsorbate_data)
-        except ValueError:
-            print('ERROR: ', adsorbate)
-        # if adsorbate_count > 5: break
-        if adsorbate_count % 100 == 0:
-            time.sleep(5)  # slow down API calls to not overwhelm the server
+    def tasks():
+        """Queue the downloads as the listing is decoded"""
+        for adsorbate in adsorbates:
+            filename = adsorbate['InChIKey'] + '.json'
+            url = api_url('/isodb/api/gas/', adsorbate['InChIKey'],
+                          api_tracking)
+            yield url, adsorbate_folder + '/' + filename
+
+    return adsorbates, tasks()
+
+
+def regenerate_adsorbates(api_tracking=True,
+                          workers=API_WORKERS,
+                          rate_limit=API_RATE_LIMIT,
+                          resume=False):
+    """Generate the entire ISODB library from the API"""
+    limiter = make_limiter(rate_limit)
+    adsorbates, tasks = adsorbate_tasks(api_tracking, limiter)
+    # Progress is printed here, from the main thread, not by the workers
+    for (url, _), error in run_resumable(download_adsorbate,
+                                         tasks,
+                                         DownloadManifest(),
+                                         resume=resume,
+                                         workers=workers,
+                                         limiter=limiter):
+        if error is None:
+            print(url)
+    print(adsorbates.count, 'Adsorbate Species Entries')
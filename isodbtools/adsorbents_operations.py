@@ -2,41 +2,67 @@
 """Module to provide operations related to adsorbent objects
 """
 import os
-import json
-import time
 import copy
-import requests
 
-from .config import API_HOST, HEADERS, JSON_FOLDER, json_writer, TRACKER_SUFFIX
+from .config import JSON_FOLDER, json_writer, API_RATE_LIMIT, API_WORKERS
+from .http_client import api_url, get_json, not_found
+from .throttle import make_limiter
+from .manifest import DownloadManifest, run_resumable
+from .streaming import ListingStream
+from .resolver import NameResolver
+
+
+def lookup_adsorbent(name):
+    """Resolve an adsorbent name with the MATDB API (None if unknown)
+
+    Raises ValueError if the API answers with a body that is not JSON.
+    """
+    # Disable API usage tracking
+    url = api_url('/matdb/api/material/', name.lower(), api_tracking=False)
+    try:
+        material_info = get_json(url)
+    except OSError as error_handler:
+        # Only a genuine not-found is an unknown name; other errors (5xx,
+        # 429, connection, ...) propagate, so the resolver does not cache them
+        if not_found(error_handler):
+            return None
+        raise
+    return {'hashkey': material_info['hashkey'], 'name': material_info['name']}
+
+
+ADSORBENT_RESOLVER = NameResolver('adsorbent', lookup_adsorbent)
 
 
 def fix_adsorbent_id(adsorbent_input):
     """Lookup hashkey from name"""
     output = copy.deepcopy(adsorbent_input)
-    material_name = adsorbent_input['name'].lower().replace('%',
-                                                            '%25').replace(
-                                                                ' ', '%20')
-    # Disable API usage tracking
-    url = API_HOST + '/matdb/api/material/' + material_name + '.json&k=dontrackmeplease'
-    # Attempt to resolve the name using the MATDB API
+    # Attempt to resolve the name using the (cached) MATDB API
     try:
-        material_info = json.loads(requests.get(url, headers=HEADERS).content)
-        output['hashkey'] = material_info['hashkey']
-        output['name'] = material_info['name']
-        check = True
+        material_info = ADSORBENT_RESOLVER.resolve(adsorbent_input['name'])
     except ValueError:
-        check = False
-    return output, check
+        # Not a JSON answer: unknown for now, but not cached by the resolver
+        return output, False
+    if material_info is None:
+        return output, False
+    output['hashkey'] = material_info['hashkey']
+    output['name'] = material_info['name']
+    return output, True
 
 
-def regenerate_adsorbents(api_tracking=True):
-    """Generate the entire ISODB library from the API"""
-    # Set or disable API usage tracking
-    if api_tracking:
-        url_suffix = ''
-    else:
-        url_suffix = TRACKER_SUFFIX
+def download_adsorbent(task):
+    """Download one adsorbent to the Adsorbents folder"""
+    url, filename = task
+    adsorbent_data = get_json(url)
+    # Write to JSON
+    json_writer(filename, adsorbent_data)
+
 
+def adsorbent_tasks(api_tracking=True, limiter=None):
+    """Listing of the MATDB adsorbents and the download tasks it feeds
+
+    Returns the ListingStream and a generator of (url, filename) tasks for
+    download_adsorbent, queued as the listing is decoded.
+    """
     # Create the JSON Library folder if necessary
     if not os.path.exists(JSON_FOLDER):
         os.mkdir(JSON_FOLDER)
@@ -47,18 +73,37 @@ def regenerate_adsorbents(api_tracking=True):
         os.mkdir(adsorbent_folder)
 
     # Generate a list of adsorbents from the MATDB API
-    url = API_HOST + '/matdb/api/materials.json' + url_suffix
-    adsorbents = json.loads(requests.get(url, headers=HEADERS).content)
-    print(len(adsorbents), 'Adsorbent Material Entries')
+    if limiter is not None:
+        limiter.acquire()
+    url = api_url('/matdb/api/materials.json', api_tracking=api_tracking)
+    adsorbents = ListingStream(url)
 
     # Extract each adsorbent in full form
-    for (material_count, adsorbent) in enumerate(adsorbents):
-        filename = adsorbent['hashkey'] + '.json'
-        url = API_HOST + '/matdb/api/material/' + filename + url_suffix
-        print(url)
-        adsorbent_data = json.loads(requests.get(url, headers=HEADERS).content)
-        # pprint.pprint(adsorbent_data)
-        # Write to JSON
-        json_writer(adsorbent_folder + '/' + filename, adsorbent_data)
-        if material_count % 100 == 0:
-            time.sleep(5)  # slow down API calls to not overwhelm the server
+    def tasks():
+        """Queue the downloads as the listing is decoded"""
+        for adsorbent in adsorbents:
+            filename = adsorbent['hashkey'] + '.json'
+            url = api_url('/matdb/api/material/', adsorbent['hashkey'],
+                          api_tracking)
+            yield url, adsorbent_folder + '/' + filename
+
+    return adsorbents, tasks()
+
+
+def regenerate_adsorbents(api_tracking=True,
+                          workers=API_WORKERS,
+                          rate_limit=API_RATE_LIMIT,
+                          resume=False):
+    """Generate the entire ISODB library from the API"""
+    limiter = make_limiter(rate_limit)
+    adsorbents, tasks = adsorbent_tasks(api_tracking, limiter)
+    # Progress is printed here, from the main thread, not by the workers
+    for (url, _), error in run_resumable(download_adsorbent,
+                                         tasks,
+                                         DownloadManifest(),
+                                         resume=resume,
+                                         workers=workers,
+                                         limiter=limiter):
+        if error is None:
+            print(url)
+    print(adsorbents.count, 'Adsorbent Material Entries')
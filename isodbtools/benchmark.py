@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Module to benchmark the isodbtools commands end-to-end against the API stand-in
+
+Each command runs as `python -m isodbtools.utilities ...` in a scratch
+folder, with the API hosts pointed at a local StandinServer. Wall time,
+items written, items/s and the API requests issued are reported per command.
+"""
+import os
+import sys
+import glob
+import time
+import shutil
+import tempfile
+import subprocess
+
+from .config import json_writer
+from .standin import StandinServer, synthetic_dataset
+
+# pylint: disable=consider-using-f-string
+
+# name, command line (after `isodbtools.utilities`), glob of the items written
+#  ({workers} is replaced by the worker count)
+BENCHMARK_COMMANDS = [
+    ('refresh_maps', ['refresh_maps'], None),
+    ('regenerate_adsorbates',
+     ['regenerate_adsorbates', '--workers', '{workers}', '--rate-limit',
+      '0'], 'Library/Adsorbates/*.json'),
+    ('regenerate_adsorbents',
+     ['regenerate_adsorbents', '--workers', '{workers}', '--rate-limit',
+      '0'], 'Library/Adsorbents/*.json'),
+    ('regenerate_bibliography', [
+        'regenerate_bibliography', '--workers', '{workers}', '--rate-limit',
+        '0'
+    ], 'Library/Bibliography/*.json'),
+    ('regenerate_library',
+     ['regenerate_library', '--workers', '{workers}', '--rate-limit',
+      '0'], 'Library/*/*.Isotherm*.json'),
+    ('post_process_batch', [
+        'post_process_batch', 'Library/*/*.Isotherm*.json', '--workers',
+        '{workers}'
+    ], 'JSON_PACKAGE/*.json'),
+    ('generate_bibliography', ['generate_bibliography',
+                               'JSON_PACKAGE'], '*.json'),
+    ('regenerate_all',
+     ['regenerate_all', '--workers', '{workers}', '--rate-limit',
+      '0'], 'Library/*/*.json'),
+]
+
+
+def run_command(name, arguments, environment, workdir):
+    """Run one isodbtools command; returns (return code, seconds)"""
+    log = os.path.join(workdir, name + '.log')
+    start = time.perf_counter()
+    with open(log, mode='w', encoding='utf-8') as output:
+        returncode = subprocess.call(
+            [sys.executable, '-m', 'isodbtools.utilities'] + arguments,
+            cwd=workdir,
+            env=environment,
+            stdout=output,
+            stderr=subprocess.STDOUT)
+    return returncode, time.perf_counter() - start
+
+
+def run_benchmark(commands=None,
+                  workers=4,
+                  latency=0.01,
+                  jitter=0.0,
+                  error_rate=0.0,
+                  dataset=None,
+                  workdir=None,
+                  report=None):
+    # pylint: disable-msg=too-many-arguments
+    # pylint: disable-msg=too-many-locals
+    """Benchmark isodbtools commands against a local API stand-in
+
+    commands: names from BENCHMARK_COMMANDS (default: all, in order; later
+      commands use the output of earlier ones)
+    latency, jitter, error_rate: stand-in settings (see StandinServer)
+    dataset: stand-in routes (default: `synthetic_dataset()`)
+    workdir: scratch folder, kept for inspection (default: a temporary one)
+    report: optional path of a JSON report
+    Returns a list of per-command results.
+    """
+    selected = [
+        x for x in BENCHMARK_COMMANDS if commands is None or x[0] in commands
+    ]
+    cleanup = workdir is None
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='isodb-benchmark-')
+    os.makedirs(workdir, exist_ok=True)
+    if dataset is None:
+        dataset = synthetic_dataset()
+
+    results = []
+    server = StandinServer(dataset,
+                           latency=latency,
+                           jitter=jitter,
+                           error_rate=error_rate)
+    try:
+        with server:
+            # Isolate the run from the user's caches and snapshot
+            environment = dict(os.environ)
+            environment.update(server.environment())
+            environment['ISODB_CACHE_DIR'] = os.path.join(workdir, 'cache')
+            environment['ISODB_SNAPSHOT'] = os.path.join(
+                workdir, 'cache', 'api_maps.json')
+            package = os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__)))
+            environment['PYTHONPATH'] = os.pathsep.join(
+                filter(None, [package, environment.get('PYTHONPATH')]))
+
+            for name, arguments, pattern in selected:
+                arguments = [x.format(workers=workers) for x in arguments]
+                before = server.snapshot_counts()
+                returncode, seconds = run_command(name, arguments, environment,
+                                                  workdir)
+                after = server.snapshot_counts()
+                counts = {
+                    key: after[key] - before.get(key, 0)
+                    for key in after if after[key] != before.get(key, 0)
+                }
+                items = len(glob.glob(os.path.join(workdir,
+                                                   pattern))) if pattern else 0
+                result = {'command': name, 'returncode': returncode}
+                result['seconds'] = seconds
+                result['items'] = items
+                result['items_per_second'] = items / seconds
+                result['requests'] = counts.pop('requests', 0)
+                result['injected_errors'] = counts.pop('injected_errors', 0)
+                result['not_found'] = counts.pop('not_found', 0)
+                result['endpoints'] = counts
+                results.append(result)
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    # Summary table
+    print('%-24s %6s %9s %7s %9s %9s %7s' %
+          ('command', 'status', 'seconds', 'items', 'items/s', 'requests',
+           'errors'))
+    for result in results:
+        print('%-24s %6d %9.2f %7d %9.1f %9d %7d' %
+              (result['command'], result['returncode'], result['seconds'],
+               result['items'], result['items_per_second'], result['requests'],
+               result['injected_errors']))
+    if report is not None:
+        json_writer(
+            report, {
+                'settings': {
+                    'workers': workers,
+                    'latency': latency,
+                    'jitter': jitter,
+                    'error_rate': error_rate
+                },
+                'results': results
+            })
+    return results
@@ -5,25 +5,38 @@ import os
 # import pprint
 import json
 import unicodedata
-import time
 import copy
 import glob
 import requests
 
-from .config import API_HOST, HEADERS, JSON_FOLDER, TEXTENCODE, doi_stub_rules, \
-    json_writer, TRACKER_SUFFIX
+from .config import JSON_FOLDER, TEXTENCODE, json_writer, API_RATE_LIMIT, API_WORKERS
+from .http_client import api_url, biblio_url, doi_url, get_json
+from .journals import JournalIndex, normalize_journal
+from .throttle import make_limiter
+from .manifest import DownloadManifest, run_resumable
+from .streaming import ListingStream
+from .doi_index import DoiIndex
+from .instrumentation import stage
 
 # pylint: disable=consider-using-f-string
 
 
-def regenerate_bibliography(api_tracking=True):
-    """Generate the entire ISODB library from the API"""
-    # Set or disable API usage tracking
-    if api_tracking:
-        url_suffix = ''
-    else:
-        url_suffix = TRACKER_SUFFIX
+def download_biblio(task):
+    """Download one bibliography entry to the Bibliography folder"""
+    url, filename = task
+    biblio_data = get_json(url)[0]  # look at the API call here
+    # Write to JSON
+    json_writer(filename, biblio_data)
+
+
+def biblio_tasks(doi_index, api_tracking=True, limiter=None):
+    """Listing of the ISODB bibliography entries and the download tasks it feeds
 
+    Returns the ListingStream and a generator of (url, filename) tasks for
+    download_biblio, queued as the listing is decoded. File names are the DOI
+    stubs of `doi_index` (a DoiIndex), which is only read: DOIs without an
+    isotherm folder are not recorded in it.
+    """
     # Create the JSON Library folder if necessary
     if not os.path.exists(JSON_FOLDER):
         os.mkdir(JSON_FOLDER)
@@ -34,36 +47,39 @@ def regenerate_bibliography(api_tracking=True):
         os.mkdir(biblio_folder)
 
     # Generate a list of adsorbents from the MATDB API
-    url = API_HOST + '/isodb/api/biblios.json' + url_suffix
-    bibliography = json.loads(requests.get(url, headers=HEADERS).content)
-    print(len(bibliography), 'Bibliography Entries')
+    if limiter is not None:
+        limiter.acquire()
+    url = api_url('/isodb/api/biblios.json', api_tracking=api_tracking)
+    bibliography = ListingStream(url)
 
     # Extract each paper in full form
-    for (biblio_count, biblio) in enumerate(bibliography):
-        doi = biblio['DOI']
-        doi_stub = biblio['DOI']
-        for rule in doi_stub_rules:
-            doi_stub = doi_stub.replace(rule['old'], rule['new'])
-        doi_stub = doi_stub.lower()
-        url = API_HOST + '/isodb/api/biblio/' + doi + '.json' + url_suffix
-        url = url.replace('%', '%25')  # make this substitution first
-        url = url.replace('+', '%252B')
-        try:
-            biblio_data = json.loads(
-                requests.get(
-                    url,
-                    headers=HEADERS).content)[0]  # look at the API call here
-            # pprint.pprint(biblio_data)
-            # Write to JSON
-            filename = doi_stub + '.json'
-            json_writer(biblio_folder + '/' + filename, biblio_data)
-        except ValueError:
-            print('ERROR: ', doi)
-            print(url)
-        # if biblio_count > 5:
-        #     break
-        if biblio_count % 100 == 0:
-            time.sleep(5)  # slow down API calls to not overwhelm the server
+    def tasks():
+        """Queue the downloads as the listing is decoded"""
+        for biblio in bibliography:
+            doi = biblio['DOI']
+            url = biblio_url(doi, api_tracking)
+            filename = doi_index.stub(doi) + '.json'
+            yield url, biblio_folder + '/' + filename
+
+    return bibliography, tasks()
+
+
+def regenerate_bibliography(api_tracking=True,
+                            workers=API_WORKERS,
+                            rate_limit=API_RATE_LIMIT,
+                            resume=False):
+    """Generate the entire ISODB library from the API"""
+    limiter = make_limiter(rate_limit)
+    with DoiIndex() as doi_index:
+        bibliography, tasks = biblio_tasks(doi_index, api_tracking, limiter)
+        for _ in run_resumable(download_biblio,
+                               tasks,
+                               DownloadManifest(),
+                               resume=resume,
+                               workers=workers,
+                               limiter=limiter):
+            pass
+    print(bibliography.count, 'Bibliography Entries')
 
 
 journal_fixes = {
@@ -89,14 +105,20 @@ journal_fixes = {
     'journal of environmental sciences':
     'Journal of Environmental Sciences-China'
 }
+# journal_fixes by normalized name (see normalize_journal)
+normalized_journal_fixes = {
+    normalize_journal(raw): fixed
+    for raw, fixed in journal_fixes.items()
+}
 
 
 def fix_journal(journal_in):
-    """Point Corrections for journals with inconsistent naming"""
-    output = journal_fixes.get(journal_in)
-    if output is None:
-        output = journal_in
-    return output
+    """Point Corrections for journals with inconsistent naming
+
+    Matches journal_fixes by normalized name, as the JournalIndex aliases do.
+    """
+    return normalized_journal_fixes.get(normalize_journal(journal_in),
+                                        journal_in)
 
 
 def extract_names(string):
@@ -119,59 +141,100 @@ def extract_names(string):
     return {'given': given, 'middle': middle}
 
 
+def index_isotherms(filenames):
+    """Parse a set of isotherm files once into a per-DOI metadata index
+
+    DOIs are matched case-insensitively; the index preserves the order (and
+    spelling) in which each DOI is first seen.
+    """
+    index = {}
+    for filename in filenames:
+        with open(filename, mode='r', encoding='utf-8') as handle:
+            with stage('json_decode'):
+                isotherm = json.load(handle)
+        entry = index.get(isotherm['DOI'].lower())
+        if entry is None:
+            entry = {
+                'DOI': isotherm['DOI'],
+                'adsorbates': set(),
+                'adsorbents': set(),
+                'temperatures': set(),
+                'categories': set(),
+                'pressure_min': 1.0e10,  # initialize this absurdly
+                'pressure_max': -1.0e10,  # initialize this absurdly
+                'isotherms': []
+            }
+            index[isotherm['DOI'].lower()] = entry
+
+        entry['adsorbents'].add(str(isotherm['adsorbent']['hashkey']))
+        if str(isotherm['category']) != '':
+            entry['categories'].add(str(isotherm['category']))
+        entry['temperatures'].add(int(isotherm['temperature']))
+        for adsorbate in isotherm['adsorbates']:
+            entry['adsorbates'].add(adsorbate['InChIKey'])
+        for point in isotherm['isotherm_data']:
+            entry['pressure_min'] = min(entry['pressure_min'],
+                                        point['pressure'])
+            entry['pressure_max'] = max(entry['pressure_max'],
+                                        point['pressure'])
+
+        # Correction to pressure range
+        entry['pressure_min'] = max(entry['pressure_min'], 0.0)
+        entry['pressure_max'] = min(entry['pressure_max'], 1000.0)
+
+        entry['isotherms'].append(filename.split('/')[-1])
+    return index
+
+
 def generate_bibliography(folder, simulate_api=False):
     # pylint: disable-msg=too-many-locals
     # pylint: disable-msg=too-many-branches
     # pylint: disable-msg=too-many-statements
-    """Generate a bibliography entry given a set of isotherms"""
+    """Generate a bibliography entry given a set of isotherms
+
+    DOIs whose journal cannot be matched are skipped; returns a dictionary
+    of those DOIs with their ranked (score, journal) candidates.
+    """
     # Generate a list of isotherms to process
     if folder[-1] != '/':
         folder += '/'
     filenames = glob.glob(folder + '*')
     filenames = [x for x in filenames if 'isotherm' in x or 'Isotherm' in x]
-    # Extract the unique dois
-    dois = []
-    for filename in filenames:
-        with open(filename, mode='r', encoding='utf-8') as handle:
-            isotherm = json.load(handle)
-        if isotherm['DOI'].lower() not in [x.lower() for x in dois]:
-            dois.append(isotherm['DOI'])
-    # print(dois)
+    # Parse every isotherm once, collecting the metadata for each unique DOI
+    index = index_isotherms(filenames)
+    if not index:
+        return {}
+
+    # Journal lookup index (fetched and built once for all DOIs)
+    journals = JournalIndex(
+        get_json(api_url('/isodb/api/journals-lookup.json')), journal_fixes)
+    unknown_journals = {}
+    doi_index = DoiIndex(read_only=True)
 
-    for doi in dois:
+    for entry in index.values():
+        doi = entry['DOI']
         # Pull bibliographic metadata from the dx.doi.org API
         try:
-            url = 'https://doi.org/' + doi
-            bib_info = json.loads(requests.get(url, headers=HEADERS).content)
-        except ValueError as error_handler:
+            bib_info = get_json(doi_url(doi))
+        except (ValueError, requests.HTTPError) as error_handler:
             raise RuntimeError('ERROR: DOI problem for:' +
                                doi) from error_handler
         title = bib_info['title'].encode(TEXTENCODE).decode()
-        journal = (bib_info['container-title'].replace(
-            '.', '').encode(TEXTENCODE).lower().decode())
-        journal = fix_journal(journal)
+        journal = bib_info['container-title'].encode(TEXTENCODE).decode()
         year = int(bib_info['issued']['date-parts'][0][0])
 
         # -----------------------------
         # Match Journal Name/Abbreviation to existing lookup
-        url = API_HOST + '/isodb/api/journals-lookup.json'
-        journals = json.loads(requests.get(url, headers=HEADERS).content)
-        if journal in [x['name'].lower() for x in journals]:
-            # Attempt to match journal by name (lower case)
-            index = [x['name'].lower() for x in journals].index(journal)
-            journal = {'journal_id': journals[index]['id']}
-            journal['name'] = journals[index]['name']
-        elif journal in [
-                x['abbreviation'].lower().replace('.', '') for x in journals
-        ]:
-            # attempt to match journal by abbreviation (lower case, strip out periods)
-            index = [
-                x['abbreviation'].lower().replace('.', '') for x in journals
-            ].index(journal.replace('.', ''))
-            journal = {'journal_id': journals[index]['id']}
-            journal['abbreviation'] = journals[index]['abbreviation']
-        else:
-            raise Exception('Unknown Journal: ', journal)
+        match = journals.lookup(journal)
+        if match is None:
+            # Never reassigned automatically: report the closest journals
+            print('Unknown Journal: ', journal, 'for DOI', doi)
+            unknown_journals[doi] = [
+                (score, journals.journals[position])
+                for score, position, _ in journals.candidates(journal)
+            ]
+            continue
+        journal = journals.reference(*match)
         # ------------------------------
         # Parse the author list
         authors = []
@@ -194,45 +257,20 @@ def generate_bibliography(folder, simulate_api=False):
                     block['orc_id'] = author['ORCID'].replace(
                         'http://orcid.org/', '')
             authors.append(block)
-        # Collect metadata from the isotherms
-        adsorbates = []
-        adsorbents = []
-        temperatures = []
-        categories = []
-        min_pressure = 1.0e10  # initialize this absurdly
-        max_pressure = -1.0e10  # initialize this absurdly
-        isotherms = []
-
-        for filename in filenames:
-            with open(filename, mode='r', encoding='utf-8') as handle:
-                isotherm = json.load(handle)
-            if isotherm['DOI'].lower() == doi.lower():
-
-                adsorbents.append(str(isotherm['adsorbent']['hashkey']))
-                if str(isotherm['category']) != '':
-                    categories.append(str(isotherm['category']))
-                temperatures.append(int(isotherm['temperature']))
-                for adsorbate in isotherm['adsorbates']:
-                    adsorbates.append(adsorbate['InChIKey'])
-                for point in isotherm['isotherm_data']:
-                    min_pressure = min(min_pressure, point['pressure'])
-                    max_pressure = max(max_pressure, point['pressure'])
-
-                # Correction to pressure range
-                min_pressure = max(min_pressure, 0.0)
-                max_pressure = min(max_pressure, 1000.0)
-
-                isotherms.append(filename.split('/')[-1])
-
-        # Reduce redundant lists to unique lists and convert to dictionaries
-        adsorbents = [{'hashkey': x} for x in sorted(list(set(adsorbents)))]
-        categories = [{'name': x} for x in sorted(list(set(categories)))]
-        temperatures = list(set(temperatures))
-        adsorbates = [{'InChIKey': x} for x in sorted(list(set(adsorbates)))]
+        # Metadata collected from the isotherms
+        min_pressure = entry['pressure_min']
+        max_pressure = entry['pressure_max']
+
+        # Convert unique metadata to dictionaries
+        adsorbents = [{'hashkey': x} for x in sorted(entry['adsorbents'])]
+        categories = [{'name': x} for x in sorted(entry['categories'])]
+        temperatures = list(entry['temperatures'])
+        adsorbates = [{'InChIKey': x} for x in sorted(entry['adsorbates'])]
         # This is an odd sorting algorithm, but is necessary to immitate the API
         #  Sort is case insensitive, but preserves filename case
-        isotherms = sorted([x.replace('.json', '') for x in isotherms],
-                           key=str.casefold)
+        isotherms = sorted(
+            [x.replace('.json', '') for x in entry['isotherms']],
+            key=str.casefold)
         isotherms = [{'filename': x} for x in isotherms]
 
         # Build the JSON Structure
@@ -250,11 +288,8 @@ def generate_bibliography(folder, simulate_api=False):
         biblio['authors'] = authors
         biblio['isotherms'] = isotherms
 
-        # Write to disk
-        doi_stub = doi
-        for rule in doi_stub_rules:
-            doi_stub = doi_stub.replace(rule['old'], rule['new'])
-        doi_stub = doi_stub.lower()
+        # Write to disk (named as in the library mirror)
+        doi_stub = doi_index.stub(doi)
 
         if not simulate_api:
             # Write the bibliography file for database admin
@@ -285,21 +320,32 @@ def generate_bibliography(folder, simulate_api=False):
             biblio_api['adsorbateGas'] = []
             for adsorbate in biblio_api['adsorbates']:
                 # Look up name associated with InChIKey
-                url = (API_HOST + '/isodb/api/gas/' + adsorbate['InChIKey'] +
-                       '.json&k=dontrackmeplease')
-                info = json.loads(requests.get(url, headers=HEADERS).content)
+                info = get_json(
+                    api_url('/isodb/api/gas/',
+                            adsorbate['InChIKey'],
+                            api_tracking=False))
                 adsorbate['name'] = info['name']
                 biblio_api['adsorbateGas'].append(info['name'])
             # Adsorbents List
             biblio_api['adsorbentMaterial'] = []
             for adsorbent in biblio_api['adsorbents']:
                 # Look up name associated with hashkey
-                url = (API_HOST + '/matdb/api/material/' +
-                       adsorbent['hashkey'] + '.json&k=dontrackmeplease')
-                info = json.loads(requests.get(url, headers=HEADERS).content)
+                info = get_json(
+                    api_url('/matdb/api/material/',
+                            adsorbent['hashkey'],
+                            api_tracking=False))
                 adsorbent['name'] = info['name']
                 biblio_api['adsorbentMaterial'].append(info['name'])
             # to disk
             json_writer(doi_stub + '.json.API',
                         biblio_api)  # simulate_api=True
             # pprint.pprint(biblio_api)
+
+    # Report the DOIs skipped for an unknown journal, with ranked candidates
+    for doi, candidates in unknown_journals.items():
+        print('No bibliography written for', doi, '- journal candidates:')
+        for score, journal in candidates:
+            print('  %.2f  %s (%s) id=%s' %
+                  (score, journal['name'], journal.get('abbreviation'),
+                   journal['id']))
+    return unknown_journals
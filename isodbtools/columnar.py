@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Module to provide a columnar, memory-mappable export of isotherm points
+"""
+import os
+import json
+import array
+import numpy as np
+
+from .config import JSON_FOLDER, COLUMNAR_FOLDER, json_writer
+from .library_index import iter_library_files
+
+# Flat arrays written by export_columnar: one row per (point, species)
+#  (array typecodes: q = int64, i = int32, d = float64)
+COLUMNS = {
+    'isotherm_id': 'q',
+    'pressure': 'd',
+    'species': 'i',
+    'adsorption': 'd',
+}
+
+
+def as_numpy(values):
+    """View an array.array as a NumPy array without copying"""
+    if not values:
+        return np.zeros(0, dtype=values.typecode)
+    return np.frombuffer(values, dtype=values.typecode)
+
+
+def export_columnar(folder=JSON_FOLDER, output=COLUMNAR_FOLDER):
+    """Export every isotherm point of a library as flat NumPy arrays
+
+    Writes <column>.npy for the columns in COLUMNS, offsets.npy (rows of
+    isotherm i are offsets[i]:offsets[i+1]), species.json (species index ->
+    InChIKey) and isotherms.json (isotherm id -> library path).
+    """
+    columns = {name: array.array(code) for name, code in COLUMNS.items()}
+    offsets = array.array('q', [0])
+    species = {}
+    isotherms = []
+    for filename, _ in iter_library_files(folder):
+        with open(filename, mode='r', encoding='utf-8') as handle:
+            isotherm = json.load(handle)
+        isotherm_id = len(isotherms)
+        isotherms.append(
+            os.path.relpath(filename, folder).replace(os.sep, '/'))
+        for point in isotherm['isotherm_data']:
+            for block in point['species_data']:
+                key = block.get('InChIKey', block.get('name'))
+                columns['isotherm_id'].append(isotherm_id)
+                columns['pressure'].append(point['pressure'])
+                columns['species'].append(species.setdefault(
+                    key, len(species)))
+                columns['adsorption'].append(block['adsorption'])
+        offsets.append(len(columns['isotherm_id']))
+
+    if not os.path.exists(output):
+        os.mkdir(output)
+    for name, values in columns.items():
+        np.save(os.path.join(output, name + '.npy'), as_numpy(values))
+    np.save(os.path.join(output, 'offsets.npy'), as_numpy(offsets))
+    json_writer(os.path.join(output, 'species.json'), list(species))
+    json_writer(os.path.join(output, 'isotherms.json'), isotherms)
+    print(len(isotherms), 'Isotherms,', len(columns['isotherm_id']),
+          'point/species rows exported to', output)
+
+
+def load_columnar(output=COLUMNAR_FOLDER, mmap_mode='r'):
+    """Open a columnar export; arrays are memory-mapped by default
+
+    Returns a dictionary of the column arrays plus 'offsets', 'species' and
+    'isotherms'.
+    """
+    data = {}
+    for name in list(COLUMNS) + ['offsets']:
+        data[name] = np.load(os.path.join(output, name + '.npy'),
+                             mmap_mode=mmap_mode)
+    for name in ('species', 'isotherms'):
+        with open(os.path.join(output, name + '.json'),
+                  mode='r',
+                  encoding='utf-8') as handle:
+            data[name] = json.load(handle)
+    return data
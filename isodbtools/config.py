@@ -2,25 +2,73 @@
 # pylint: disable-msg=unspecified-encoding
 """Module to provide global variables for isodb-tools
 """
+import io
 import os
 import json
-import requests
-import requests_cache
+import glob
+import shutil
+import tempfile
+import multiprocessing
 
-requests_cache.install_cache('api_map_cache')
+from . import json_backend
+from .instrumentation import stage, count
 
 # Global Variables
-API_HOST = 'https://adsorption.nist.gov'
+#  (the hosts can be redirected, e.g. to the local stand-in in `standin`)
+API_HOST = os.environ.get('ISODB_API_HOST', 'https://adsorption.nist.gov')
+DOI_HOST = os.environ.get('ISODB_DOI_HOST', 'https://doi.org')
 HEADERS = {'Accept': 'application/citeproc+json'}  # JSON Headers
 TEXTENCODE = 'utf-8'
 CANONICALIZE = 'NFKC'
 TRACKER_SUFFIX = '&k=dontrackmeplease'
 
+# JSON serialization backend ('auto', 'orjson' or 'stdlib'); output is
+# byte-identical to the stdlib encoder. Set ISODB_JSON_VERIFY to check it.
+JSON_BACKEND = os.environ.get('ISODB_JSON_BACKEND', 'auto')
+JSON_VERIFY = bool(os.environ.get('ISODB_JSON_VERIFY'))
+
 SCRIPT_PATH = os.path.split(os.path.realpath(__file__))[0]
 ROOT_DIR = os.getcwd()
 DOI_MAPPING_PATH = os.path.join(ROOT_DIR, 'DOI_mapping.csv')
 JSON_FOLDER = os.path.join(ROOT_DIR, 'Library')
 
+# Download throttling for library regeneration
+API_RATE_LIMIT = 5.0  # requests per second, shared by all download threads
+API_WORKERS = 1  # concurrent download threads (1 = serial)
+
+# Shares of the request budget in `regenerate_all` (tasks per scheduling round)
+REGENERATE_PRIORITIES = {
+    'adsorbates': 4,
+    'adsorbents': 4,
+    'bibliography': 2,
+    'isotherms': 1
+}
+
+# Shared HTTP client (see `http_client`)
+HTTP_TIMEOUT = (10.0, 60.0)  # seconds to connect, and between received bytes
+HTTP_RETRIES = 3  # retries of failed connections and 429/5xx responses
+HTTP_BACKOFF = 0.5  # seconds; exponential backoff between retries
+HTTP_RETRY_STATUS = (429, 500, 502, 503, 504)
+HTTP_POOL_SIZE = 16  # connections kept (and allowed) per host
+
+# Download manifest for resumable library regeneration
+MANIFEST_PATH = os.path.join(JSON_FOLDER, 'manifest.json')
+DOWNLOAD_RETRIES = 2  # retry passes over failed items at the end of a run
+DOWNLOAD_RETRY_DELAY = 5.0  # seconds, multiplied by the retry attempt
+
+# Isotherms withdrawn upstream, moved aside by `sync_library`
+QUARANTINE_FOLDER = os.path.join(ROOT_DIR, 'Quarantine')
+
+# Library folders holding reference entities rather than isotherms
+LIBRARY_REFERENCE_FOLDERS = ('Adsorbates', 'Adsorbents', 'Bibliography')
+
+# SQLite index of the isotherm metadata, kept in the indexed library folder
+#  (see `index_library`)
+LIBRARY_INDEX_NAME = 'library_index.sqlite'
+
+# Columnar (memory-mappable) export of all isotherm points
+COLUMNAR_FOLDER = os.path.join(ROOT_DIR, 'Columnar')
+
 # Mapping rules
 KEYS_API_MAPPING = {
     'isotherm_type': '/isotherm-type-map.json',
@@ -30,10 +78,27 @@ KEYS_API_MAPPING = {
     'pressureUnits': '/pressure-units-map.json'
 }
 
-MAPS = {}
-for item, url in KEYS_API_MAPPING.items():
-    json_data = requests.get(API_HOST + '/isodb/api' + url).json()
-    MAPS[item] = {'json': json_data}
+# Adsorption-unit lookup tables (input name -> ID -> default name)
+UNITS_API_MAPPING = {
+    'all': '/adsorption-unit-lookup.json',
+    'default': '/default-adsorption-unit-lookup.json'
+}
+
+# Per-user folder for offline snapshots and caches
+CACHE_DIR = os.environ.get(
+    'ISODB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.isodbtools'))
+
+# Offline snapshot of the API reference maps (refresh with `refresh_maps`)
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PATH = os.environ.get('ISODB_SNAPSHOT',
+                               os.path.join(CACHE_DIR, 'api_maps.json'))
+SNAPSHOT_CACHE = {}
+
+# Persistent cache of adsorbate/adsorbent name resolutions
+RESOLVER_CACHE_PATH = os.path.join(CACHE_DIR, 'names.sqlite')
+RESOLVER_TTL = 30 * 86400.0  # seconds a resolved name stays valid
+RESOLVER_NEGATIVE_TTL = 86400.0  # seconds an unknown name stays cached
+RESOLVER_LRU_SIZE = 4096  # names held in memory per resolver
 
 # Character Substitution Rules for Converting the DOI to a stub
 doi_stub_rules = [
@@ -84,6 +149,25 @@ pressure_units = {
     'mbar': 1.0e-03,
 }
 
+# Adsorption Conversions (to mmol/g); units per mass of adsorbate
+#  (to mg/g) also need the molar mass of the adsorbate
+MOLAR_VOLUME_STP = 22.413969545014  # L/mol, ideal gas at 273.15 K and 1 atm
+adsorption_units = {
+    'mmol/g': 1.0,
+    'mol/kg': 1.0,
+    'mmol/kg': 1.0e-03,
+    'mol/g': 1.0e+03,
+    'umol/g': 1.0e-03,
+    'cm3(STP)/g': 1.0 / MOLAR_VOLUME_STP,
+    'ml(STP)/g': 1.0 / MOLAR_VOLUME_STP,
+}
+adsorption_mass_units = {
+    'mg/g': 1.0,
+    'g/g': 1.0e+03,
+    'g/kg': 1.0,
+    'wt%': 10.0,
+}
+
 # Canonical Keys for Isotherm JSON (required keys for ISODB)
 canonical_keys = [
     'DOI',
@@ -116,19 +200,117 @@ def doi_stub_generator(input_doi):
 
 
 # Wrapper function for JSON writes to ensure consistency in formatting
+def json_serialize(data, verify=None):
+    """Serialize JSON according to ISODB specs (the text json_writer writes)
+
+    Uses the JSON_BACKEND serializer; with `verify` (default JSON_VERIFY) the
+    output is checked against the stdlib encoder. Objects with a `to_json`
+    method (e.g. an Isotherm) are serialized as the dictionary it returns.
+    """
+    if hasattr(data, 'to_json'):
+        data = data.to_json()
+    if verify is None:
+        verify = JSON_VERIFY
+    return json_backend.serialize(data, backend=JSON_BACKEND, verify=verify)
+
+
 def json_writer(filename, data):
-    """Format JSON according to ISODB specs"""
-    with open(filename, mode='w') as output:
-        json.dump(data, output, ensure_ascii=False, sort_keys=True,
-                  indent=4)  # formatting rules
-        output.write('\n')  # new line at EOF
+    """Format JSON according to ISODB specs
+
+    `filename` may also be an open text or binary file object, e.g. an
+    in-memory buffer used by a batch writer.
+    """
+    with stage('write'):
+        text = json_serialize(data)
+        count('write.files')
+        count('write.characters', len(text))
+        if hasattr(filename, 'write'):
+            if isinstance(filename, io.TextIOBase):
+                filename.write(text)
+            else:
+                filename.write(text.encode(TEXTENCODE))
+            return
+        with open(filename, mode='w') as output:
+            output.write(text)
 
 
 def clean_json(filename):
-    """Read in JSON and output according to ISODB specs"""
-    print('operate on filename: ', filename)
-    with open(filename, mode='r') as infile:
-        isotherm_data = json.load(infile)
-    os.rename(filename, filename + '.bak')
-    json_writer(filename, isotherm_data)
-    os.remove(filename + '.bak')
+    """Read in JSON and output according to ISODB specs
+
+    Files that are already canonical are not touched; others are replaced
+    atomically (temporary file + rename). Returns True if rewritten.
+    """
+    with open(filename, mode='r', newline='') as infile:
+        text = infile.read()
+    canonical = json_serialize(json.loads(text))
+    if canonical.replace('\n', os.linesep) == text:
+        return False
+    handle, temp_name = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)),
+        prefix='.' + os.path.basename(filename) + '.',
+        suffix='.tmp')
+    try:
+        with os.fdopen(handle, mode='w') as output:
+            output.write(canonical)
+        shutil.copymode(filename, temp_name)
+        os.replace(temp_name, filename)
+    finally:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+    return True
+
+
+def expand_json_paths(paths):
+    """Expand files, directories (recursively) and glob patterns to JSON files"""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                filenames += [
+                    os.path.join(root, x) for x in sorted(files)
+                    if x.endswith('.json')
+                ]
+        elif os.path.isfile(path):
+            filenames.append(path)
+        else:
+            filenames += sorted(glob.glob(path, recursive=True))
+    return filenames
+
+
+def clean_json_worker(filename):
+    """Clean one file, returning (filename, rewritten or error message)"""
+    try:
+        return filename, clean_json(filename)
+    except (OSError, ValueError) as error_handler:
+        return filename, repr(error_handler)
+
+
+def clean_json_tree(paths, workers=None):
+    """Run clean_json over files, directory trees and globs on a process pool
+
+    Returns a dictionary with the rewritten, unchanged and failed filenames.
+    """
+    filenames = expand_json_paths(paths)
+    summary = {'rewritten': [], 'unchanged': [], 'failed': []}
+
+    def tally(results):
+        for filename, result in results:
+            if result is True:
+                print('operate on filename: ', filename)
+                summary['rewritten'].append(filename)
+            elif result is False:
+                summary['unchanged'].append(filename)
+            else:
+                print('ERROR: ', filename, result)
+                summary['failed'].append(filename)
+
+    if workers == 1 or len(filenames) <= 1:
+        tally(map(clean_json_worker, filenames))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            tally(
+                pool.imap_unordered(clean_json_worker, filenames,
+                                    chunksize=64))
+    print(len(summary['rewritten']), 'rewritten,', len(summary['unchanged']),
+          'unchanged,', len(summary['failed']), 'failed')
+    return summary
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Module to provide the persistent DOI <-> DOI stub index of the library
+
+The index is kept in DOI_mapping.csv and loaded once into two dictionaries
+(DOI -> stub, stub -> DOI). New assignments are appended to the file as they
+are made. The stub rules drop characters, so different DOIs can produce the
+same stub; `assign` detects this and gives the later DOI a distinct stub
+('<stub>_2', ...), so their folders and files never overwrite each other.
+"""
+import os
+import threading
+
+from .config import DOI_MAPPING_PATH, doi_stub_generator
+from .instrumentation import count
+
+DOI_MAPPING_HEADER = 'DOI,  "DOI_Stub"\n'
+
+
+def read_doi_mapping(path=DOI_MAPPING_PATH):
+    """DOI -> DOI stub entries of a DOI_mapping.csv, in file order"""
+    mapping = {}
+    if os.path.exists(path):
+        with open(path, mode='r', encoding='utf-8') as handle:
+            next(handle, None)  # header
+            for line in handle:
+                if ', ' in line:
+                    doi, doi_stub = line.rstrip('\n').rsplit(', ', 1)
+                    mapping[doi] = doi_stub
+    return mapping
+
+
+def write_doi_mapping(mapping, path=DOI_MAPPING_PATH):
+    """Write a DOI_mapping.csv (atomically)"""
+    with open(path + '.tmp', mode='w', encoding='utf-8') as output:
+        output.write(DOI_MAPPING_HEADER)
+        for doi, doi_stub in mapping.items():
+            output.write(doi + ', ' + doi_stub + '\n')
+    os.replace(path + '.tmp', path)
+
+
+class DoiIndex:
+    """Bidirectional DOI <-> DOI stub index backed by DOI_mapping.csv
+
+    DOIs are matched case-insensitively. With `read_only`, assignments are
+    kept in memory only (e.g. for dry runs).
+    """
+    def __init__(self, path=DOI_MAPPING_PATH, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.output = None
+        self.stubs = {}  # lowercase DOI -> stub
+        self.dois = {}  # stub -> DOI
+        self.collisions = []  # (DOI, DOI holding the natural stub, stub)
+        for doi, doi_stub in read_doi_mapping(path).items():
+            if doi_stub in self.dois and self.dois[doi_stub].lower(
+            ) != doi.lower():
+                # Written by earlier runs: the folder holds both articles
+                print('DOI stub collision in', path + ':', doi, 'and',
+                      self.dois[doi_stub], '->', doi_stub)
+                self.collisions.append((doi, self.dois[doi_stub], doi_stub))
+                continue
+            self.stubs[doi.lower()] = doi_stub
+            self.dois[doi_stub] = doi
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.stubs)
+
+    def __contains__(self, doi):
+        return doi.lower() in self.stubs
+
+    def items(self):
+        """(DOI, stub) pairs, in assignment order"""
+        return [(doi, doi_stub) for doi_stub, doi in self.dois.items()]
+
+    def stub(self, doi):
+        """Stub of a DOI: the assigned one, else the one the rules produce"""
+        doi_stub = self.stubs.get(doi.lower())
+        return doi_stub_generator(doi) if doi_stub is None else doi_stub
+
+    def doi(self, doi_stub):
+        """DOI of a stub (None if unassigned)"""
+        return self.dois.get(doi_stub)
+
+    def assign(self, doi):
+        """Stub of a DOI, assigning (and recording) a new one if needed"""
+        key = doi.lower()
+        with self.lock:
+            if key in self.stubs:
+                return self.stubs[key]
+            doi_stub = doi_stub_generator(doi)
+            if doi_stub in self.dois:
+                # Another DOI already owns this stub: disambiguate
+                count('doi_index.collisions')
+                print('DOI stub collision:', doi, 'and', self.dois[doi_stub],
+                      '->', doi_stub)
+                self.collisions.append((doi, self.dois[doi_stub], doi_stub))
+                suffix = 2
+                while doi_stub + '_' + str(suffix) in self.dois:
+                    suffix += 1
+                doi_stub += '_' + str(suffix)
+            self.stubs[key] = doi_stub
+            self.dois[doi_stub] = doi
+            if not self.read_only:
+                self.append(doi, doi_stub)
+            return doi_stub
+
+    def remove(self, doi):
+        """Drop a DOI from the index (written to disk by `save`)"""
+        with self.lock:
+            doi_stub = self.stubs.pop(doi.lower())
+            del self.dois[doi_stub]
+
+    def append(self, doi, doi_stub):
+        """Append one entry to the CSV file (lock held by caller)"""
+        if self.output is None:
+            new_file = not os.path.exists(self.path) or not os.path.getsize(
+                self.path)
+            # pylint: disable-msg=consider-using-with
+            self.output = open(self.path, mode='a', encoding='utf-8')
+            if new_file:
+                self.output.write(DOI_MAPPING_HEADER)
+        self.output.write(doi + ', ' + doi_stub + '\n')
+        self.output.flush()
+
+    def save(self):
+        """Rewrite the CSV file from the index (atomically)"""
+        if self.read_only:
+            return
+        with self.lock:
+            self.close()
+            write_doi_mapping(dict(self.items()), self.path)
+
+    def close(self):
+        """Close the CSV file opened for appending"""
+        if self.output is not None:
+            self.output.close()
+            self.output = None
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""Module to find duplicate and near-duplicate isotherms across the library
+
+Exact duplicates share the hash of their canonical isotherm_data (points
+sorted, species sorted, floats rounded to 12 significant digits). For
+near-duplicates (e.g. the same figure digitized twice), every isotherm is
+resampled to a fixed-length curve signature; signatures are hashed with
+random-projection LSH inside blocks of the same adsorbent, adsorbates and
+temperature, and only the isotherms sharing a bucket are compared. The cost
+grows roughly linearly with the size of the library.
+"""
+import os
+import json
+import hashlib
+import itertools
+import collections
+import numpy as np
+
+from .config import JSON_FOLDER, json_writer
+from .library_index import iter_library_files
+from .interpolation import isotherm_series
+from .instrumentation import stage, count
+
+# pylint: disable=consider-using-f-string
+
+# Near-duplicates cover (nearly) the same pressure range
+MIN_OVERLAP = 0.9
+
+
+def canonical_float(value):
+    """Float rounded to 12 significant digits, as text"""
+    return '%.12g' % value
+
+
+def content_hash(isotherm):
+    """SHA-256 of the canonical form of isotherm_data"""
+    points = sorted((canonical_float(point['pressure']),
+                     sorted((block.get('InChIKey', block.get('name')),
+                             canonical_float(block['adsorption']))
+                            for block in point['species_data']))
+                    for point in isotherm['isotherm_data'])
+    text = json.dumps(points, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def block_key(isotherm):
+    """Metadata an isotherm must share with its near-duplicates"""
+    return (isotherm.get('adsorbent', {}).get('hashkey'),
+            tuple(
+                sorted(
+                    x.get('InChIKey', x.get('name', ''))
+                    for x in isotherm.get('adsorbates', []))),
+            round(float(isotherm.get('temperature') or 0.0)))
+
+
+def sorted_series(isotherm):
+    """{species: (pressures, adsorptions)} arrays of an isotherm, by pressure"""
+    curves = {}
+    for key, pressures, adsorptions in isotherm_series(isotherm):
+        order = np.argsort(pressures, kind='stable')
+        curves[key] = (np.asarray(pressures, dtype=float)[order],
+                       np.asarray(adsorptions, dtype=float)[order])
+    return curves
+
+
+def curve_signature(curves, samples):
+    """Fixed-length signature of the curves of an isotherm (see sorted_series)
+
+    Per species: adsorption resampled at `samples` pressures evenly spread
+    over the measured range (scaled by the largest adsorption), plus the
+    log10 of the scale and of the pressure range.
+    """
+    signature = []
+    for key in sorted(curves):
+        pressure, adsorption = curves[key]
+        scale = max(np.abs(adsorption).max(), 1e-12)
+        grid = np.linspace(pressure[0], pressure[-1], samples)
+        signature.extend(np.interp(grid, pressure, adsorption) / scale)
+        signature += [
+            np.log10(scale),
+            np.log10(max(pressure[-1], 1e-12)),
+            pressure[0] / max(pressure[-1], 1e-12)
+        ]
+    return np.array(signature)
+
+
+def curve_distance(first, second, samples=32):
+    # pylint: disable-msg=too-many-locals
+    """Relative RMS difference of two isotherms over their common pressures
+
+    first, second: curves (see sorted_series). Infinite when the species
+    differ or the pressure ranges overlap by less than MIN_OVERLAP of their
+    union.
+    """
+    if first.keys() != second.keys():
+        return np.inf
+    distance = 0.0
+    for key, (pressure_a, adsorption_a) in first.items():
+        pressure_b, adsorption_b = second[key]
+        low = max(pressure_a[0], pressure_b[0])
+        high = min(pressure_a[-1], pressure_b[-1])
+        union = max(pressure_a[-1], pressure_b[-1]) - min(
+            pressure_a[0], pressure_b[0])
+        if high < low or (union > 0 and high - low < MIN_OVERLAP * union):
+            return np.inf
+        grid = np.linspace(low, high, samples)
+        curve_a = np.interp(grid, pressure_a, adsorption_a)
+        curve_b = np.interp(grid, pressure_b, adsorption_b)
+        scale = max(np.abs(curve_a).max(), np.abs(curve_b).max(), 1e-12)
+        distance = max(distance,
+                       np.sqrt(np.mean((curve_a - curve_b)**2)) / scale)
+    return distance
+
+
+class CurveHasher:
+    # pylint: disable-msg=too-few-public-methods
+    """Random-projection (p-stable) LSH of curve signatures
+
+    Each of `bands` tables hashes a signature to the floors of `rows`
+    random projections divided by `width`; close signatures share a bucket
+    in at least one table with high probability.
+    """
+    def __init__(self, bands=16, rows=4, width=0.25, seed=0):
+        self.bands = bands
+        self.rows = rows
+        self.width = width
+        self.seed = seed
+        self.projections = {}  # signature length -> (matrix, offsets)
+
+    def keys(self, signature):
+        """Bucket key of the signature in each table"""
+        size = len(signature)
+        if size not in self.projections:
+            rng = np.random.default_rng((self.seed, size))
+            self.projections[size] = (rng.standard_normal(
+                (self.bands * self.rows, size)),
+                                      rng.uniform(0.0, self.width,
+                                                  self.bands * self.rows))
+        matrix, offsets = self.projections[size]
+        cells = np.floor((matrix @ signature + offsets) / self.width)
+        cells = cells.astype(np.int64).reshape(self.bands, self.rows)
+        return [(band, size) + tuple(x)
+                for band, x in enumerate(cells.tolist())]
+
+
+def find_duplicates(folder=JSON_FOLDER,
+                    tolerance=0.02,
+                    samples=16,
+                    hasher=None,
+                    report=None):
+    # pylint: disable-msg=too-many-locals
+    """Find exact and near-duplicate isotherms in a library
+
+    tolerance: largest relative RMS difference (see curve_distance) of
+      near-duplicates
+    samples: resampled points per species in the LSH signatures
+    hasher: a CurveHasher (default: CurveHasher())
+    Returns {'exact': [[paths]], 'near': [[path, path, distance]],
+    'summary': {...}}; with `report`, it is also written as JSON.
+    """
+    hasher = CurveHasher() if hasher is None else hasher
+    exact = collections.defaultdict(list)
+    records = {}  # path -> (block key, curves), one per hash and block
+    represented = set()
+    for filename, _ in iter_library_files(folder):
+        with open(filename, mode='r', encoding='utf-8') as handle:
+            with stage('json_decode'):
+                isotherm = json.load(handle)
+        path = os.path.relpath(filename, folder).replace(os.sep, '/')
+        with stage('hash'):
+            digest = content_hash(isotherm)
+            exact[digest].append(path)
+            key = block_key(isotherm)
+            if (digest, key) not in represented and isotherm['isotherm_data']:
+                represented.add((digest, key))
+                records[path] = (key, sorted_series(isotherm))
+
+    # Near-duplicates: LSH buckets within each metadata block
+    buckets = collections.defaultdict(list)
+    with stage('hash'):
+        for path, (key, curves) in records.items():
+            for bucket in hasher.keys(curve_signature(curves, samples)):
+                buckets[(key, ) + bucket].append(path)
+    candidates = set()
+    for paths in buckets.values():
+        candidates.update(itertools.combinations(paths, 2))
+    count('duplicates.candidates', len(candidates))
+    near = []
+    with stage('compare'):
+        for first, second in sorted(candidates):
+            distance = curve_distance(records[first][1], records[second][1])
+            if distance <= tolerance:
+                near.append([first, second, float(distance)])
+
+    groups = [paths for paths in exact.values() if len(paths) > 1]
+    result = {
+        'exact': groups,
+        'near': near,
+        'summary': {
+            'isotherms': sum(len(x) for x in exact.values()),
+            'exact_groups': len(groups),
+            'exact_duplicates': sum(len(x) - 1 for x in groups),
+            'candidate_pairs': len(candidates),
+            'near_pairs': len(near)
+        }
+    }
+    for paths in groups:
+        print('EXACT', ' '.join(paths))
+    for first, second, distance in near:
+        print('NEAR  %s %s %.4f' % (first, second, distance))
+    summary = result['summary']
+    print(summary['isotherms'], 'isotherms,', summary['exact_duplicates'],
+          'exact duplicates in', summary['exact_groups'], 'groups,',
+          summary['near_pairs'], 'near-duplicate pairs')
+    if report is not None:
+        json_writer(report, result)
+    return result
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Module to provide the shared HTTP client for the ISODB/MATDB and doi.org APIs
+
+All API requests go through one pooled `requests.Session` per process, so
+connections (and TLS sessions) are reused. Requests time out, 429/5xx
+responses are retried with exponential backoff (honouring Retry-After), and
+the connections per host are capped. Error responses left after the retries
+raise requests.HTTPError (see `not_found`).
+"""
+import os
+import json
+import threading
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .instrumentation import stage, count
+from .config import API_HOST, DOI_HOST, HEADERS, TRACKER_SUFFIX, HTTP_TIMEOUT, HTTP_RETRIES, \
+    HTTP_BACKOFF, HTTP_RETRY_STATUS, HTTP_POOL_SIZE
+
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+
+def make_session(pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES):
+    """New Session with connection pooling and retry/backoff"""
+    retry = Retry(total=retries,
+                  backoff_factor=HTTP_BACKOFF,
+                  status_forcelist=HTTP_RETRY_STATUS,
+                  raise_on_status=False)  # `get` raises on the last response
+    # pool_block: at most `pool_size` connections per host, shared by threads
+    adapter = HTTPAdapter(pool_connections=4,
+                          pool_maxsize=pool_size,
+                          max_retries=retry,
+                          pool_block=True)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def shared_session():
+    """The shared Session of this process (created on first use)"""
+    pid = os.getpid()
+    with SESSIONS_LOCK:
+        if pid not in SESSIONS:
+            SESSIONS.clear()  # sessions inherited from a parent process
+            SESSIONS[pid] = make_session()
+        return SESSIONS[pid]
+
+
+def quote_key(key):
+    """Percent-encode an item key (name, DOI, InChIKey, ...) for a URL path
+
+    '/' is kept (DOIs).
+    """
+    return urllib.parse.quote(key, safe='/')
+
+
+def api_url(endpoint, key=None, api_tracking=True):
+    """URL of an ISODB/MATDB API endpoint
+
+    endpoint: path below API_HOST, e.g. '/isodb/api/gases.json', or the
+      collection path (e.g. '/isodb/api/gas/') when `key` is given
+    key: item key, percent-encoded and followed by '.json'
+    api_tracking: False appends the suffix disabling API usage tracking
+    """
+    url = API_HOST + endpoint
+    if key is not None:
+        url += quote_key(key) + '.json'
+    if not api_tracking:
+        url += TRACKER_SUFFIX
+    return url
+
+
+def biblio_url(doi, api_tracking=True):
+    """URL of the ISODB bibliography entry of a DOI
+
+    The biblio endpoint decodes '+' twice, so it is escaped as '%252B'.
+    """
+    url = api_url('/isodb/api/biblio/', doi, api_tracking)
+    return url.replace('%2B', '%252B')
+
+
+def doi_url(doi):
+    """URL of the doi.org (citeproc) metadata of a DOI"""
+    return DOI_HOST + '/' + urllib.parse.quote(doi, safe='/')
+
+
+def get(url, headers=None, stream=False):
+    """GET a URL with the shared session, timeout and retries
+
+    Raises requests.HTTPError for an error status (after the retries).
+    """
+    count('http.requests')
+    with stage('http'):
+        response = shared_session().get(
+            url,
+            headers=HEADERS if headers is None else headers,
+            timeout=HTTP_TIMEOUT,
+            stream=stream)
+        if not stream:
+            count('http.bytes', len(response.content))
+    if not response.ok:
+        count('http.errors')
+        response.close()
+        response.raise_for_status()
+    return response
+
+
+def get_json(url, headers=None):
+    """GET a URL and decode its JSON body
+
+    Raises requests.HTTPError for an error status and ValueError if the body
+    is not JSON.
+    """
+    content = get(url, headers=headers).content
+    with stage('json_decode'):
+        return json.loads(content)
+
+
+def not_found(error):
+    """Whether an exception is a 404 (Not Found) response"""
+    return isinstance(error, requests.HTTPError) and getattr(
+        error.response, 'status_code', None) == 404
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Module to provide per-stage timers and counters for profiling the commands
+
+Stages (e.g. 'http', 'json_decode', 'transform', 'write') are timed with
+`stage`; counters (requests, bytes, cache hits, items) are bumped with
+`count`. Times are exclusive: time spent in a nested stage (e.g. an 'http'
+lookup during 'transform') is counted under the nested stage only, so the
+stages do not overlap. They are summed over threads, so with concurrent
+downloads a stage can exceed the wall time. `profile_report` turns the
+totals into the JSON report written by the CLI `--profile` option.
+"""
+import time
+import threading
+import contextlib
+import collections
+
+STATS_LOCK = threading.Lock()
+NESTING = threading.local()  # per thread: time of the nested stages, by level
+STAGES = collections.defaultdict(lambda: [0, 0.0])  # stage -> [calls, seconds]
+COUNTERS = collections.Counter()
+
+
+def record(name, seconds):
+    """Add one call of stage `name` taking `seconds`"""
+    with STATS_LOCK:
+        timer = STAGES[name]
+        timer[0] += 1
+        timer[1] += seconds
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a block of work as one call of stage `name`
+
+    The time of the stages nested in the block is not counted in `name`.
+    """
+    if not hasattr(NESTING, 'levels'):
+        NESTING.levels = []
+    NESTING.levels.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = NESTING.levels.pop()
+        if NESTING.levels:
+            NESTING.levels[-1] += elapsed
+        record(name, elapsed - nested)
+
+
+def count(name, amount=1):
+    """Add `amount` to counter `name`"""
+    with STATS_LOCK:
+        COUNTERS[name] += amount
+
+
+def drain():
+    """Return and reset the totals (e.g. to send them from a worker process)"""
+    with STATS_LOCK:
+        totals = {'stages': dict(STAGES), 'counters': dict(COUNTERS)}
+        STAGES.clear()
+        COUNTERS.clear()
+    return totals
+
+
+def merge(totals):
+    """Add totals returned by `drain` in another process"""
+    with STATS_LOCK:
+        for name, (calls, seconds) in totals['stages'].items():
+            STAGES[name][0] += calls
+            STAGES[name][1] += seconds
+        COUNTERS.update(totals['counters'])
+
+
+def profile_report(wall_seconds):
+    """Report of the stage timers, counters, cache hit rates and throughput"""
+    with STATS_LOCK:
+        stages = {
+            name: {
+                'calls': calls,
+                'seconds': seconds,
+                'mean_seconds': seconds / calls if calls else 0.0
+            }
+            for name, (calls, seconds) in sorted(STAGES.items())
+        }
+        counters = dict(sorted(COUNTERS.items()))
+
+    # Hit rates of the caches counting '<cache>.hits' and '<cache>.misses'
+    caches = {}
+    for name in counters:
+        if name.endswith('.hits'):
+            cache = name[:-len('.hits')]
+            hits = counters[name]
+            misses = counters.get(cache + '.misses', 0)
+            caches[cache] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else None
+            }
+
+    def rate(amount, seconds):
+        return amount / seconds if seconds else None
+
+    http_seconds = sum(
+        stages.get(x, {}).get('seconds', 0.0) for x in ('http', 'http_stream'))
+    throughput = {
+        'items_per_second':
+        rate(counters.get('items.completed', 0), wall_seconds),
+        'requests_per_second':
+        rate(counters.get('http.requests', 0), wall_seconds),
+        'http_bytes_per_second':
+        rate(counters.get('http.bytes', 0), http_seconds),
+        'write_characters_per_second':
+        rate(counters.get('write.characters', 0),
+             stages.get('write', {}).get('seconds', 0.0))
+    }
+    return {
+        'wall_seconds': wall_seconds,
+        'stages': stages,
+        'counters': counters,
+        'caches': caches,
+        'throughput': throughput
+    }
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""Module to provide batched adsorption queries at arbitrary pressures across the library
+
+The isotherms are loaded once into padded NumPy arrays (one row per isotherm
+and adsorbate, pressures in bar, sorted). Queries select rows by metadata
+and interpolate every selected row at every target pressure in a few array
+operations, linearly in pressure or in log10(pressure). Targets outside the
+measured range of a row give NaN (no extrapolation).
+"""
+import os
+import json
+import numpy as np
+
+from .config import JSON_FOLDER, json_writer
+from .library_index import iter_library_files
+from .reference_maps import reference_snapshot
+from .units import UnitRegistry
+from .adsorbates_operations import ADSORBATE_RESOLVER
+from .instrumentation import stage
+
+QUERY_CHUNK = 1 << 22  # elements of the (rows, points, targets) comparison block
+METADATA = ('filename', 'doi', 'inchikey', 'adsorbate', 'adsorbent',
+            'adsorbent_name', 'temperature', 'category', 'units', 'mixture')
+
+
+def isotherm_series(isotherm):
+    """(InChIKey, pressures, adsorptions) of each adsorbate of an isotherm"""
+    series = {}
+    for point in isotherm['isotherm_data']:
+        for block in point['species_data']:
+            key = block.get('InChIKey', block.get('name'))
+            pressures, adsorptions = series.setdefault(key, ([], []))
+            pressures.append(point['pressure'])
+            adsorptions.append(block['adsorption'])
+    return [(key, values[0], values[1]) for key, values in series.items()]
+
+
+def adsorbate_aliases(folder):
+    """Lowercase names, formulas and synonyms -> InChIKey of the adsorbates
+    mirrored in the Adsorbates subfolder of a library
+    """
+    aliases = {}
+    adsorbate_folder = os.path.join(folder, 'Adsorbates')
+    if not os.path.isdir(adsorbate_folder):
+        return aliases
+    for filename in sorted(os.listdir(adsorbate_folder)):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(adsorbate_folder, filename),
+                  mode='r',
+                  encoding='utf-8') as handle:
+            gas = json.load(handle)
+        names = [gas.get('name'), gas.get('formula')]
+        names += gas.get('synonyms') or []
+        for name in names:
+            if isinstance(name, str) and name:
+                aliases.setdefault(name.lower(), gas['InChIKey'])
+    return aliases
+
+
+class IsothermBatch:
+    """Isotherms packed into padded arrays for batched interpolation
+
+    pressure, adsorption: (rows, max points) arrays, each row sorted by
+      pressure and padded with +inf pressures and NaN adsorptions
+    length: points of each row
+    metadata: the METADATA arrays, one entry per row ('adsorbate' holds
+      lowercase names)
+    aliases: lowercase adsorbate name/formula/synonym -> InChIKey (see
+      adsorbate_aliases), used by `select`
+    """
+    def __init__(self, rows, aliases=None):
+        width = max((len(x['pressure']) for x in rows), default=0)
+        self.pressure = np.full((len(rows), width), np.inf)
+        self.adsorption = np.full((len(rows), width), np.nan)
+        self.length = np.zeros(len(rows), dtype=np.int64)
+        for (i, row) in enumerate(rows):
+            order = np.argsort(row['pressure'], kind='stable')
+            self.length[i] = len(order)
+            self.pressure[i, :len(order)] = row['pressure'][order]
+            self.adsorption[i, :len(order)] = row['adsorption'][order]
+        self.metadata = {
+            name: np.array([x[name] for x in rows],
+                           dtype=float if name == 'temperature' else object)
+            for name in METADATA
+        }
+        self.aliases = {} if aliases is None else aliases
+        self.log_pressure = None
+
+    def __len__(self):
+        return len(self.length)
+
+    @classmethod
+    def from_library(cls, folder=JSON_FOLDER, convert_units=False):
+        # pylint: disable-msg=too-many-locals
+        """Load every isotherm of a library
+
+        With `convert_units`, adsorptions are converted to mmol/g; rows whose
+        units cannot be converted (e.g. per mass of adsorbate) are skipped.
+        """
+        registry = UnitRegistry(reference_snapshot(offline=True))
+        rows = []
+        for filename, _ in iter_library_files(folder):
+            with open(filename, mode='r', encoding='utf-8') as handle:
+                with stage('json_decode'):
+                    isotherm = json.load(handle)
+            try:
+                p_conversion = registry.pressure_factor(
+                    isotherm.get('pressureUnits') or 'bar')
+                q_conversion = registry.adsorption_factor(
+                    isotherm['adsorptionUnits']) if convert_units else 1.0
+            except ValueError:
+                continue
+            names = {
+                x.get('InChIKey'): x.get('name', '')
+                for x in isotherm['adsorbates']
+            }
+            adsorbent = isotherm.get('adsorbent', {})
+            filename = os.path.relpath(filename, folder).replace(os.sep, '/')
+            for key, pressures, adsorptions in isotherm_series(isotherm):
+                row = {
+                    'filename': filename,
+                    'doi': isotherm.get('DOI'),
+                    'inchikey': key,
+                    'adsorbate': (names.get(key) or key).lower(),
+                    'adsorbent': adsorbent.get('hashkey'),
+                    'adsorbent_name': adsorbent.get('name'),
+                    'temperature': isotherm.get('temperature', np.nan),
+                    'category': isotherm.get('category'),
+                    'units': isotherm['adsorptionUnits'],
+                    'mixture': len(names) > 1
+                }
+                if convert_units:
+                    row['units'] = 'mmol/g'
+                row['pressure'] = np.asarray(pressures,
+                                             dtype=float) * p_conversion
+                row['adsorption'] = np.asarray(adsorptions,
+                                               dtype=float) * q_conversion
+                rows.append(row)
+        return cls(rows, adsorbate_aliases(folder))
+
+    def select(self,
+               adsorbate=None,
+               adsorbent=None,
+               temperature=None,
+               temperature_tolerance=0.5,
+               category=None,
+               mixtures=False):
+        # pylint: disable-msg=too-many-arguments
+        """Indices of the rows matching the criteria
+
+        adsorbate: InChIKey, or name, formula or synonym (case-insensitive;
+          see `inchikey`)
+        adsorbent: adsorbent hashkey
+        temperature: K, matched within +/- temperature_tolerance
+        category: isotherm category (e.g. 'exp', 'sim')
+        mixtures: include the adsorbates of multicomponent isotherms
+        """
+        metadata = self.metadata
+        mask = np.ones(len(self), dtype=bool)
+        if adsorbate is not None:
+            mask &= (metadata['inchikey'] == self.inchikey(adsorbate)) | (
+                metadata['adsorbate'] == adsorbate.lower())
+        if adsorbent is not None:
+            mask &= metadata['adsorbent'] == adsorbent
+        if temperature is not None:
+            mask &= np.abs(metadata['temperature'] -
+                           temperature) <= temperature_tolerance
+        if category is not None:
+            mask &= metadata['category'] == category
+        if not mixtures:
+            mask &= ~metadata['mixture'].astype(bool)
+        return np.flatnonzero(mask)
+
+    def inchikey(self, adsorbate):
+        """InChIKey of an adsorbate name, formula or synonym (e.g. 'CO2')
+
+        Uses the library aliases, then the adsorbate names already resolved
+        in the local cache (no API request); else returns `adsorbate`.
+        """
+        key = self.aliases.get(adsorbate.lower())
+        if key is None:
+            _, gas = ADSORBATE_RESOLVER.peek(adsorbate)
+            key = adsorbate if gas is None else gas['InChIKey']
+        return key
+
+    def interpolate(self, pressures, rows=None, log_pressure=False):
+        # pylint: disable-msg=too-many-locals
+        """Adsorption of `rows` (default: all) at each target pressure (bar)
+
+        Returns a (rows, targets) array. With `log_pressure`, interpolation is
+        linear in log10(pressure) and points at pressure <= 0 are ignored.
+        """
+        targets = np.atleast_1d(np.asarray(pressures, dtype=float))
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        result = np.full((len(rows), len(targets)), np.nan)
+        if rows.size == 0 or self.pressure.shape[1] == 0:
+            return result
+        if log_pressure:
+            if self.log_pressure is None:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    self.log_pressure = np.log10(
+                        np.where(self.pressure > 0, self.pressure, np.nan))
+            pressure = self.log_pressure
+            with np.errstate(divide='ignore', invalid='ignore'):
+                targets = np.log10(np.where(targets > 0, targets, np.nan))
+        else:
+            pressure = self.pressure
+
+        width = pressure.shape[1]
+        step = max(1, QUERY_CHUNK // (width * len(targets)))
+        for begin in range(0, len(rows), step):
+            block = rows[begin:begin + step]
+            x = pressure[block]
+            y = self.adsorption[block]
+            last = self.length[block][:, None] - 1
+            # Points ignored at the start of each row (log10 of p <= 0)
+            start = np.count_nonzero(np.isnan(x), axis=1)[:, None]
+            # Valid points at or below each target, bracketing points
+            below = np.count_nonzero(x[:, :, None] <= targets[None, None, :],
+                                     axis=1)
+            # Rows without valid points (all p <= 0) have start == width;
+            # their indices are kept in bounds and `below` is 0 there
+            lower = np.minimum(
+                np.clip(start + below - 1, start, np.maximum(last - 1, start)),
+                width - 1)
+            upper = np.minimum(lower + 1, last)
+            x_lower = np.take_along_axis(x, lower, axis=1)
+            x_upper = np.take_along_axis(x, upper, axis=1)
+            y_lower = np.take_along_axis(y, lower, axis=1)
+            y_upper = np.take_along_axis(y, upper, axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                span = x_upper - x_lower
+                weight = np.where(span > 0, (targets - x_lower) / span, 0.0)
+            values = y_lower + weight * (y_upper - y_lower)
+            inside = (below > 0) & (targets <= np.take_along_axis(
+                x, np.maximum(last, 0), axis=1))
+            result[begin:begin + len(block)] = np.where(inside, values, np.nan)
+        return result
+
+    def query(self, pressures, log_pressure=False, **criteria):
+        """Select rows (see `select`) and interpolate them at `pressures`
+
+        Returns a dictionary of the METADATA arrays of the selected rows plus
+        'pressures' and 'adsorption' (rows, targets).
+        """
+        rows = self.select(**criteria)
+        result = {name: self.metadata[name][rows] for name in METADATA}
+        result['pressures'] = np.atleast_1d(np.asarray(pressures, dtype=float))
+        result['adsorption'] = self.interpolate(pressures, rows, log_pressure)
+        return result
+
+
+def query_uptake(pressures,
+                 folder=JSON_FOLDER,
+                 log_pressure=False,
+                 convert_units=False,
+                 report=None,
+                 **criteria):
+    # pylint: disable-msg=too-many-arguments
+    """Adsorption at `pressures` (bar) of every matching isotherm of a library
+
+    criteria: see IsothermBatch.select. Returns a list of dictionaries (one
+    per isotherm and adsorbate, None where a pressure is out of range); with
+    `report`, it is also written as JSON.
+    """
+    batch = IsothermBatch.from_library(folder, convert_units=convert_units)
+    result = batch.query(pressures, log_pressure=log_pressure, **criteria)
+    rows = []
+    for i in range(len(result['adsorption'])):
+        row = {name: result[name][i] for name in METADATA}
+        row['temperature'] = float(row['temperature'])
+        row['mixture'] = bool(row['mixture'])
+        row['uptake'] = [
+            None if np.isnan(x) else float(x) for x in result['adsorption'][i]
+        ]
+        rows.append(row)
+    print(len(rows), 'isotherms matched;', len(batch), 'loaded')
+    if report is not None:
+        json_writer(
+            report, {
+                'pressures': result['pressures'].tolist(),
+                'log_pressure': log_pressure,
+                'results': rows
+            })
+    return rows
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Module to provide the compact, array-backed Isotherm object
+
+The metadata of an isotherm are held in __slots__ and its points in NumPy
+arrays (one row per point, one column per species), instead of one dict per
+point and per species. `Isotherm.from_json` and `to_json` convert to and
+from the ISODB JSON schema without loss: json_writer accepts an Isotherm and
+writes the same text as for the dictionary it was built from.
+"""
+import json
+import numpy as np
+
+from .config import canonical_keys, json_writer
+from .library_index import iter_library_files
+
+# pylint: disable=consider-using-f-string
+
+METADATA_KEYS = tuple(x for x in canonical_keys if x != 'isotherm_data')
+POINT_KEYS = ('pressure', 'total_adsorption')
+BLOCK_KEYS = ('adsorption', 'composition')
+EXACT_INTEGER = 2**53  # larger integers are not exact as float64
+
+
+def numeric(value):
+    """Whether a JSON value is stored in the arrays (else kept as an extra)"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    return not isinstance(value, int) or abs(value) < EXACT_INTEGER
+
+
+class Isotherm:
+    # pylint: disable-msg=too-many-instance-attributes
+    """An isotherm with __slots__ metadata and array-backed points
+
+    Metadata: one slot per canonical key (unset slots are absent keys), plus
+      `extra` for any other top-level key
+    species: (field, value) identifying each column, e.g. ('InChIKey', ...)
+    pressure: (points,) array
+    adsorption, composition: (points, species) arrays; composition is None
+      when no point has one
+    total_adsorption: (points,) array or None
+    present: (points, species) mask of the species listed in each point
+    integers: {array name: mask of the entries that were JSON integers}
+    order: {point: column order} for points not listing species in column order
+    point_extras, block_extras: keys outside the arrays, by point and by
+      (point, column)
+    """
+    __slots__ = METADATA_KEYS + ('extra', 'species', 'pressure', 'adsorption',
+                                 'composition', 'total_adsorption', 'present',
+                                 'integers', 'order', 'point_extras',
+                                 'block_extras')
+
+    def __init__(self, **metadata):
+        self.extra = {}
+        for key, value in metadata.items():
+            if key in METADATA_KEYS:
+                setattr(self, key, value)
+            else:
+                self.extra[key] = value
+        self.species = []
+        self.pressure = np.zeros(0)
+        self.adsorption = np.zeros((0, 0))
+        self.composition = None
+        self.total_adsorption = None
+        self.present = np.zeros((0, 0), dtype=bool)
+        self.integers = {}
+        self.order = {}
+        self.point_extras = {}
+        self.block_extras = {}
+
+    def __len__(self):
+        return len(self.pressure)
+
+    @property
+    def metadata(self):
+        """The top-level keys other than isotherm_data, as a dictionary"""
+        metadata = {
+            key: getattr(self, key)
+            for key in METADATA_KEYS if hasattr(self, key)
+        }
+        metadata.update(self.extra)
+        return metadata
+
+    @classmethod
+    def from_json(cls, data):
+        # pylint: disable-msg=too-many-locals
+        # pylint: disable-msg=too-many-branches
+        """Isotherm from a dictionary in the ISODB JSON schema"""
+        points = data.get('isotherm_data', [])
+        isotherm = cls(
+            **{k: v
+               for k, v in data.items() if k != 'isotherm_data'})
+        # Species columns, in order of first appearance
+        columns = {}
+        for point in points:
+            for block in point['species_data']:
+                field = 'InChIKey' if 'InChIKey' in block else 'name'
+                columns.setdefault((field, block[field]), len(columns))
+        isotherm.species = list(columns)
+        shape = (len(points), len(columns))
+        arrays = {
+            'pressure': np.full(len(points), np.nan),
+            'total_adsorption': np.full(len(points), np.nan),
+            'adsorption': np.full(shape, np.nan),
+            'composition': np.full(shape, np.nan)
+        }
+        integers = {
+            name: np.zeros(x.shape, dtype=bool)
+            for name, x in arrays.items()
+        }
+        found = set()
+        present = np.zeros(shape, dtype=bool)
+
+        def store(name, index, value):
+            arrays[name][index] = value
+            integers[name][index] = isinstance(value, int)
+            found.add(name)
+
+        for (i, point) in enumerate(points):
+            extras = {}
+            for key, value in point.items():
+                if key in POINT_KEYS and numeric(value):
+                    store(key, i, value)
+                elif key != 'species_data':
+                    extras[key] = value
+            if np.isnan(arrays['pressure'][i]):
+                raise ValueError('Point %d has no numeric pressure' % i)
+            if extras:
+                isotherm.point_extras[i] = extras
+            order = []
+            for block in point['species_data']:
+                field = 'InChIKey' if 'InChIKey' in block else 'name'
+                j = columns[(field, block[field])]
+                if present[i, j]:
+                    raise ValueError('Species listed twice in point %d' % i)
+                present[i, j] = True
+                order.append(j)
+                extras = {}
+                for key, value in block.items():
+                    if key in BLOCK_KEYS and numeric(value):
+                        store(key, (i, j), value)
+                    elif key != field:
+                        extras[key] = value
+                if extras:
+                    isotherm.block_extras[(i, j)] = extras
+            if order != sorted(order):
+                isotherm.order[i] = order
+
+        isotherm.pressure = arrays['pressure']
+        isotherm.adsorption = arrays['adsorption']
+        isotherm.present = present
+        for name in ('composition', 'total_adsorption'):
+            if name in found:
+                setattr(isotherm, name, arrays[name])
+        isotherm.integers = {
+            name: mask
+            for name, mask in integers.items() if mask.any()
+        }
+        return isotherm
+
+    def value(self, name, index):
+        """JSON value of an array entry (None if the entry is absent)"""
+        values = getattr(self, name)
+        if values is None or np.isnan(values[index]):
+            return None
+        if name in self.integers and self.integers[name][index]:
+            return int(values[index])
+        return float(values[index])
+
+    def entries(self, keys, index):
+        """{key: JSON value} of the entries present at `index`"""
+        entries = {}
+        for key in keys:
+            value = self.value(key, index)
+            if value is not None:
+                entries[key] = value
+        return entries
+
+    def to_json(self):
+        """Dictionary in the ISODB JSON schema"""
+        data = self.metadata
+        points = []
+        for i in range(len(self)):
+            point = self.entries(POINT_KEYS, i)
+            point.update(self.point_extras.get(i, {}))
+            columns = self.order.get(i, np.flatnonzero(self.present[i]))
+            point['species_data'] = [self.block(i, j) for j in columns]
+            points.append(point)
+        data['isotherm_data'] = points
+        return data
+
+    def block(self, i, j):
+        """species_data entry of column j in point i"""
+        field, name = self.species[j]
+        block = {field: name}
+        block.update(self.entries(BLOCK_KEYS, (i, j)))
+        block.update(self.block_extras.get((i, j), {}))
+        return block
+
+    @classmethod
+    def from_file(cls, filename):
+        """Isotherm from an ISODB JSON file"""
+        with open(filename, mode='r', encoding='utf-8') as handle:
+            return cls.from_json(json.load(handle))
+
+    def write(self, filename):
+        """Write the isotherm with json_writer"""
+        json_writer(filename, self)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the point arrays"""
+        arrays = [self.pressure, self.adsorption, self.present]
+        arrays += [
+            x for x in (self.composition, self.total_adsorption)
+            if x is not None
+        ]
+        arrays += list(self.integers.values())
+        return sum(x.nbytes for x in arrays)
+
+
+def load_isotherms(folder):
+    """Every isotherm of a library folder as {library path: Isotherm}"""
+    isotherms = {}
+    for filename, _ in iter_library_files(folder):
+        key = filename[len(folder):].lstrip('/\\').replace('\\', '/')
+        isotherms[key] = Isotherm.from_file(filename)
+    return isotherms
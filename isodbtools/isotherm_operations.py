@@ -3,15 +3,26 @@
 # -*- coding: utf-8 -*-
 """Module to provide operations related to isotherms"""
 import os
-import sys
+import glob
+import multiprocessing
 # import pprint
 import json
-import time
-import copy
-import requests
+import shutil
+import numpy as np
 
-from .config import API_HOST, HEADERS, JSON_FOLDER, DOI_MAPPING_PATH, doi_stub_rules, \
-    json_writer, pressure_units, canonical_keys, MAPS, TRACKER_SUFFIX
+from .config import JSON_FOLDER, QUARANTINE_FOLDER, json_writer, API_RATE_LIMIT, API_WORKERS, \
+    SNAPSHOT_CACHE
+from .http_client import api_url, get_json
+from .reference_maps import reference_snapshot
+from .units import unit_registry
+from .normalizer import isotherm_normalizer
+from .validation import is_number
+from .doi_index import DoiIndex
+from .instrumentation import stage, count, drain, merge
+from .throttle import make_limiter
+from .manifest import DownloadManifest, run_resumable
+from .streaming import ListingStream
+from .library_index import iter_library_files
 from .adsorbates_operations import fix_adsorbate_id
 from .adsorbents_operations import fix_adsorbent_id
 
@@ -21,256 +32,458 @@ def download_isotherm(isotherm):
     if isotherm[-5:] != '.json':
         isotherm += '.json'
     print('Downloading Isotherm: ', isotherm)
-    url = API_HOST + '/isodb/api/isotherm/' + isotherm
-    isotherm_data = json.loads(requests.get(url, headers=HEADERS).content)
+    url = api_url('/isodb/api/isotherm/', isotherm[:-5])
+    isotherm_data = get_json(url)
     json_writer(isotherm, isotherm_data)
 
 
-def regenerate_isotherm_library(api_tracking=True):
-    # pylint: disable-msg=too-many-locals
-    # pylint: disable-msg=consider-using-with
-    """Generate the entire ISODB library from the API"""
-    # Set or disable API usage tracking
-    if api_tracking:
-        url_suffix = ''
-    else:
-        url_suffix = TRACKER_SUFFIX
+def download_library_isotherm(task):
+    """Download one isotherm of the library to its DOI folder"""
+    url, filename = task[-2:]
+    isotherm_json = get_json(url)
+    json_writer(filename, isotherm_json)
+
 
+def isotherm_tasks(doi_index, api_tracking=True, limiter=None):
+    """Listing of the ISODB articles and the isotherm downloads it feeds
+
+    Returns the ListingStream and a generator of (doi, last isotherm of the
+    article, url, filename) tasks for download_library_isotherm, queued
+    article by article as the listing is decoded. The folder of each article
+    is assigned in `doi_index` (a DoiIndex).
+    """
     # Create the JSON Library folder if necessary
     if not os.path.exists(JSON_FOLDER):
         os.mkdir(JSON_FOLDER)
 
-    # Generate a DOI list from the ISODB API
-    url = API_HOST + '/isodb/api/biblio.json' + url_suffix
-    bibliography = json.loads(requests.get(url, headers=HEADERS).content)
-    print(len(bibliography), 'Bibliography Entries')
-
-    # Count isotherms for DOIs in the database
-    url = API_HOST + '/isodb/api/isotherms.json' + url_suffix
-    isotherms_list = json.loads(requests.get(url, headers=HEADERS).content)
-    isotherm_count = {}
-    for isotherm in isotherms_list:
-        doi = isotherm['DOI'].lower()
-        if doi not in isotherm_count:
-            isotherm_count[doi] = 1
-        else:
-            isotherm_count[doi] += 1
-    print(len(isotherms_list), 'Isotherm Files')
-
-    # Create a CSV file with the DOI -> folder mapping
-    doi_mapping = open(DOI_MAPPING_PATH, mode='w', encoding='utf-8')
-    doi_mapping.write('DOI,  "DOI_Stub"\n')
-
-    # Download and Organize the Isotherms
-    article_count = 0
-    for article in bibliography:
-        # print(article["isotherms"])
-
-        # Shorten the DOI according to rules specified in global variables
-        doi = article['DOI']
-        doi_stub = article['DOI']
-        for rule in doi_stub_rules:
-            doi_stub = doi_stub.replace(rule['old'], rule['new'])
-        doi_stub = doi_stub.lower()
-
-        num_isotherms = len(article['isotherms'])
-        # print(doi, doi_stub, num_isotherms)
-
-        # Download the isotherms
-        if num_isotherms > 0:
-            article_count += 1
-            doi_folder = os.path.join(JSON_FOLDER, doi_stub)
-            # print(doi_folder)
+    # Stream the DOI list from the ISODB API; downloads start as entries arrive
+    if limiter is not None:
+        limiter.acquire()
+    url = api_url('/isodb/api/biblio.json', api_tracking=api_tracking)
+    bibliography = ListingStream(url)
+
+    def tasks():
+        """Queue the isotherm downloads article by article"""
+        for article in bibliography:
+            if not article['isotherms']:
+                continue
+            # Folder of the article (DOI stub, unique across DOIs)
+            doi = article['DOI']
+            doi_folder = os.path.join(JSON_FOLDER, doi_index.assign(doi))
             if not os.path.exists(doi_folder):
                 os.mkdir(doi_folder)
-            doi_mapping.write(doi + ', ' + doi_stub + '\n')
 
-            for isotherm in article['isotherms']:
-                url = API_HOST + '/isodb/api/isotherm/' + isotherm[
-                    'filename'] + '.json' + url_suffix
-                isotherm_json = json.loads(
-                    requests.get(url, headers=HEADERS).content)
-                # print(json.dumps(isotherm_json, sort_keys=True))
+            last = len(article['isotherms']) - 1
+            for (i, isotherm) in enumerate(article['isotherms']):
+                url = api_url('/isodb/api/isotherm/', isotherm['filename'],
+                              api_tracking)
                 filename = os.path.join(doi_folder,
                                         isotherm['filename'] + '.json')
-                # print(filename)
-                json_writer(filename, isotherm_json)
-                # break
-            print(doi, 'Finished')
+                yield doi, i == last, url, filename
+
+    return bibliography, tasks()
+
 
-            # break
+def regenerate_isotherm_library(api_tracking=True,
+                                workers=API_WORKERS,
+                                rate_limit=API_RATE_LIMIT,
+                                resume=False):
+    """Generate the entire ISODB library from the API
 
-        # if article_count > 50: break
-        if article_count % 10 == 0:
-            time.sleep(5)  # slow down API calls to not overwhelm the server
-        # break
+    Isotherms are downloaded by `workers` threads sharing a token-bucket
+    limit of `rate_limit` requests per second (None disables the limit).
+    Progress is recorded in the download manifest; with `resume`, isotherms
+    completed by a previous run are skipped.
+    """
+    limiter = make_limiter(rate_limit)
 
+    # The DOI -> folder mapping (DOI_mapping.csv) is updated as articles arrive
+    with DoiIndex() as doi_index:
+        bibliography, tasks = isotherm_tasks(doi_index, api_tracking, limiter)
+
+        # Download and Organize the Isotherms
+        article_count = 0
+        isotherm_count = 0
+        manifest = DownloadManifest()
+        for task, error in run_resumable(download_library_isotherm,
+                                         tasks,
+                                         manifest,
+                                         resume=resume,
+                                         workers=workers,
+                                         limiter=limiter):
+            doi, article_done = task[:2]
+            if error is None:  # downloaded, or already complete
+                isotherm_count += 1
+            if article_done:
+                article_count += 1
+                print(doi, 'Finished')
+    print(bibliography.count, 'Bibliography Entries')
+    print(isotherm_count, 'Isotherm Files')
     print(article_count, 'Objects with Isotherms')
-    doi_mapping.close()
+
+
+def sync_library(api_tracking=True,
+                 workers=API_WORKERS,
+                 rate_limit=API_RATE_LIMIT,
+                 withdrawn='keep',
+                 dry_run=False):
+    # pylint: disable-msg=too-many-locals
+    # pylint: disable-msg=too-many-branches
+    # pylint: disable-msg=too-many-statements
+    """Bring the local library up to date with the API listings
+
+    Only isotherms missing from JSON_FOLDER are downloaded. Local isotherms
+    listed neither in biblio.json nor in isotherms.json are withdrawn
+    upstream; they are kept ('keep'), moved to QUARANTINE_FOLDER
+    ('quarantine') or deleted ('remove'). New DOIs are appended to
+    DOI_mapping.csv, and DOIs whose folder is gone are dropped from it. With
+    `dry_run` nothing is changed. Returns the diff as a dictionary.
+    """
+    if withdrawn not in ('keep', 'quarantine', 'remove'):
+        raise ValueError('Unknown action for withdrawn isotherms: ' +
+                         str(withdrawn))
+    limiter = make_limiter(rate_limit)
+
+    # Remote state: isotherms by library path, placed by their article DOI
+    if limiter is not None:
+        limiter.acquire()
+    remote = {}
+    remote_dois = {}
+    with DoiIndex(read_only=dry_run) as doi_index:
+        known_dois = {doi for doi, _ in doi_index.items()}
+        for article in ListingStream(
+                api_url('/isodb/api/biblio.json', api_tracking=api_tracking)):
+            if not article['isotherms']:
+                continue
+            # New DOIs are assigned a folder (and appended to DOI_mapping.csv)
+            doi_stub = doi_index.assign(article['DOI'])
+            remote_dois[article['DOI']] = doi_stub
+            for isotherm in article['isotherms']:
+                remote[doi_stub + '/' + isotherm['filename'] +
+                       '.json'] = (article['DOI'], isotherm['filename'])
+        if limiter is not None:
+            limiter.acquire()
+        listed = {
+            x['filename']
+            for x in ListingStream(
+                api_url('/isodb/api/isotherms.json',
+                        api_tracking=api_tracking))
+        }
+        placed = {x[1] for x in remote.values()}
+
+        # Local state
+        local = {}
+        if os.path.exists(JSON_FOLDER):
+            for filename, _ in iter_library_files(JSON_FOLDER):
+                local[DownloadManifest.key(filename)] = filename
+        new = [key for key in remote if key not in local]
+        gone = sorted(
+            key for key in local
+            if key not in remote and os.path.basename(key)[:-5] not in listed)
+        if gone and withdrawn != 'keep' and not remote:
+            raise RuntimeError(
+                'Empty isotherm listing from the API; refusing to '
+                'withdraw the whole library')
+        diff = {
+            'new': new,
+            'withdrawn': gone,
+            'withdrawn_action': withdrawn,
+            'unchanged': len(local) - len(gone),
+            'unplaced': sorted(listed - placed),  # listed without an article
+            'failed': [],
+            'dois_added': [],
+            'dois_removed': []
+        }
+
+        if not dry_run:
+            # Download the new isotherms only
+            if not os.path.exists(JSON_FOLDER):
+                os.mkdir(JSON_FOLDER)
+
+            def new_isotherm_tasks():
+                """Queue the new isotherm downloads"""
+                for key in new:
+                    doi, filename = remote[key]
+                    doi_folder = os.path.join(JSON_FOLDER, remote_dois[doi])
+                    if not os.path.exists(doi_folder):
+                        os.mkdir(doi_folder)
+                    url = api_url('/isodb/api/isotherm/', filename,
+                                  api_tracking)
+                    yield key, url, os.path.join(doi_folder,
+                                                 filename + '.json')
+
+            manifest = DownloadManifest()
+            for task, error in run_resumable(download_library_isotherm,
+                                             new_isotherm_tasks(),
+                                             manifest,
+                                             workers=workers,
+                                             limiter=limiter):
+                if error is not None:
+                    diff['failed'].append(task[0])
+            # Failures may have been fixed by the retry passes
+            diff['failed'] = [
+                key for key in diff['failed']
+                if not manifest.is_complete(os.path.join(JSON_FOLDER, key))
+            ]
+
+            # Withdrawn isotherms
+            if withdrawn != 'keep':
+                for key in gone:
+                    filename = local[key]
+                    if withdrawn == 'quarantine':
+                        target = os.path.join(QUARANTINE_FOLDER,
+                                              *key.split('/'))
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        shutil.move(filename, target)
+                    else:
+                        os.remove(filename)
+                    manifest.forget(filename)
+                    if not os.listdir(os.path.dirname(filename)):
+                        os.rmdir(os.path.dirname(filename))
+                manifest.save()
+
+            # DOIs whose folder is gone are dropped from the DOI mapping
+            for doi, doi_stub in doi_index.items():
+                if doi not in remote_dois and not os.path.isdir(
+                        os.path.join(JSON_FOLDER, doi_stub)):
+                    doi_index.remove(doi)
+                    diff['dois_removed'].append(doi)
+            if diff['dois_removed']:
+                doi_index.save()
+    diff['dois_added'] = [x for x in remote_dois if x not in known_dois]
+
+    print(len(new), 'new,', len(gone), 'withdrawn (' + withdrawn + '),',
+          diff['unchanged'], 'unchanged,', len(diff['failed']), 'failed,',
+          len(diff['unplaced']), 'listed without an article')
+    if dry_run:
+        print('Dry run: no files were changed')
+    return diff
 
 
 def default_adsorption_units(input_units):
-    """convert units from input units to bar"""
-    # Generate units lookup tables from API
-    url = API_HOST + '/isodb/api/default-adsorption-unit-lookup.json&k=dontrackmeplease'
-    default_units = json.loads(requests.get(url, headers=HEADERS).content)
-    url = API_HOST + '/isodb/api/adsorption-unit-lookup.json&k=dontrackmeplease'
-    all_units = json.loads(requests.get(url, headers=HEADERS).content)
-    # input -> ID -> output mapping
-    units_id = next(item for item in all_units
-                    if item['name'].lower() == input_units.lower())['id']
-    output = next(item for item in default_units
-                  if item['id'] == units_id)['name']
-    return output
-
-
-def post_process(filename):
+    """Map adsorption units to their ISODB default name"""
+    return unit_registry().default_adsorption_units(input_units)
+
+
+def isotherm_arrays(points):
+    """Load isotherm points into NumPy arrays
+
+    Returns the pressure vector, an adsorption matrix with one column per
+    species (NaN where a point lacks that species) and the species InChIKeys.
+    Pressures and adsorptions must be JSON numbers (see is_number).
+    """
+    species = {}
+    for point in points:
+        values = [point['pressure']]
+        if 'total_adsorption' in point:
+            values.append(point['total_adsorption'])
+        for block in point['species_data']:
+            species.setdefault(block['InChIKey'], len(species))
+            values.append(block['adsorption'])
+        # NumPy would accept numeric strings and booleans
+        if not all(is_number(x) for x in values):
+            raise ValueError('ERROR: non-numeric pressure or adsorption in '
+                             'isotherm_data')
+    try:
+        pressure = np.array([point['pressure'] for point in points],
+                            dtype=float)
+        adsorption = np.full((len(points), len(species)), np.nan)
+        for (i, point) in enumerate(points):
+            for block in point['species_data']:
+                adsorption[i, species[block['InChIKey']]] = block['adsorption']
+    except (TypeError, ValueError) as error_handler:
+        raise ValueError('ERROR: non-numeric pressure or adsorption in '
+                         'isotherm_data') from error_handler
+    return pressure, adsorption, list(species)
+
+
+def known_adsorbate_inchikeys():
+    """Set of the adsorbate InChIKeys already in the ISODB"""
+    adsorbates_list = get_json(api_url('/isodb/api/gases.json'))
+    return {x['InChIKey'] for x in adsorbates_list}
+
+
+def post_process(filename, adsorbate_inchikeys=None):
     # pylint: disable-msg=too-many-locals
     # pylint: disable-msg=too-many-branches
     # pylint: disable-msg=too-many-statements
-    """Function to process raw isotherm to ISDOB upload format"""
+    """Function to process raw isotherm to ISDOB upload format
+
+    `adsorbate_inchikeys` is the set of InChIKeys known to the ISODB; it is
+    downloaded (once) if not supplied. Unknown species raise a ValueError.
+    """
     with open(filename, mode='r', encoding='utf-8') as infile:
-        isotherm = json.load(infile)
-    # First-pass translation of keys based on maps provided by API
-    for key in MAPS:  # pylint: disable-msg=consider-using-dict-items
-        for item in MAPS[key]['json']:
-            # print(isotherm[key], isotherm[key].lower())
-            # print(item['name'], item['name'].lower())
-            # if isotherm[key] == item['name']:
-            #     print('match!')
-            #     isotherm[key] = item['shortname']
-            #     print(isotherm[key])
-            # print('isotherm', isotherm)
-            # raise Exception('BREAK')
-            try:
-                if isotherm[key].lower() == item['name'].lower():
-                    isotherm[key] = item['shortname']
-            except ValueError:
-                pass
-
-    # Check for adsorbate InChIKey(s)
-    #  a. isotherm metadata
-    adsorbates = isotherm['adsorbates']
-    for (i, adsorbate) in enumerate(adsorbates):
-        if 'InChIKey' not in adsorbate:
-            # Correct the gas ID using the ISODB API
-            adsorbate, check = fix_adsorbate_id(adsorbate)
-            if not check:
-                print('UNKNOWN ADSORBATE: ', adsorbate, filename)
-                sys.exit()
-            else:
-                adsorbates[i] = adsorbate
-        else:
-            # Confirm that the InChIKey is in the ISODB
-            url = API_HOST + '/isodb/api/gases.json'
-            adsorbates_list = json.loads(
-                requests.get(url, headers=HEADERS).content)
-            adsorbate_inchikeys = [x['InChIKey'] for x in adsorbates_list]
-            if adsorbate['InChIKey'] not in adsorbate_inchikeys:
-                print('new inchikey, create upload file')
-                # needs to include inchikey, name  <- double check this!!!!
-                # Extract adsorbate dictionary as a new file
-                filename = adsorbate['InChIKey'] + '.json'
-                json_writer(filename, adsorbate)
-    #  b. isotherm data points
-    for point in isotherm['isotherm_data']:
-        for species in point['species_data']:
-            if 'InChIKey' not in species:
-                # Correct the gas ID
-                adsorbate, check = fix_adsorbate_id({'name': species['name']})
+        with stage('json_decode'):
+            isotherm = json.load(infile)
+    # Nested API lookups and writes are timed under their own stages
+    with stage('transform'):
+        # First-pass translation of keys based on maps provided by API
+        normalizer = isotherm_normalizer()
+        normalizer.translate(isotherm)
+
+        # Check for adsorbate InChIKey(s)
+        #  a. isotherm metadata
+        adsorbates = isotherm['adsorbates']
+        for (i, adsorbate) in enumerate(adsorbates):
+            if 'InChIKey' not in adsorbate:
+                # Correct the gas ID using the ISODB API
+                adsorbate, check = fix_adsorbate_id(adsorbate)
                 if not check:
                     print('UNKNOWN ADSORBATE: ', adsorbate, filename)
-                    sys.exit()
-                else:
+                    raise ValueError('UNKNOWN ADSORBATE: ' + str(adsorbate))
+                adsorbates[i] = adsorbate
+            else:
+                # Confirm that the InChIKey is in the ISODB
+                if adsorbate_inchikeys is None:
+                    adsorbate_inchikeys = known_adsorbate_inchikeys()
+                if adsorbate['InChIKey'] not in adsorbate_inchikeys:
+                    print('new inchikey, create upload file')
+                    # needs to include inchikey, name  <- double check this!!!!
+                    # Extract adsorbate dictionary as a new file
+                    json_writer(adsorbate['InChIKey'] + '.json', adsorbate)
+        #  b. isotherm data points
+        for point in isotherm['isotherm_data']:
+            for species in point['species_data']:
+                if 'InChIKey' not in species:
+                    # Correct the gas ID
+                    adsorbate, check = fix_adsorbate_id(
+                        {'name': species['name']})
+                    if not check:
+                        print('UNKNOWN ADSORBATE: ', adsorbate, filename)
+                        raise ValueError('UNKNOWN ADSORBATE: ' +
+                                         str(adsorbate))
                     species['InChIKey'] = adsorbate['InChIKey']
                     del species['name']
-    # Check for adsorbent hashkey
-    adsorbent = isotherm['adsorbent']
-    if 'hashkey' not in adsorbent:
-        # Correct the material ID
-        material, check = fix_adsorbent_id(adsorbent)
-        if not check:
-            print('UNKNOWN ADSORBENT: ', adsorbent, filename)
-            sys.exit()
-        else:
+        # Check for adsorbent hashkey
+        adsorbent = isotherm['adsorbent']
+        if 'hashkey' not in adsorbent:
+            # Correct the material ID
+            material, check = fix_adsorbent_id(adsorbent)
+            if not check:
+                print('UNKNOWN ADSORBENT: ', adsorbent, filename)
+                raise ValueError('UNKNOWN ADSORBENT: ' + str(adsorbent))
             adsorbent['hashkey'] = material['hashkey']
             adsorbent['name'] = material['name']
-    # Convert pressure to bar units
-    raw_units = isotherm['pressureUnits']
-    if raw_units == 'RELATIVE':
-        try:
-            p_conversion = isotherm['saturationPressure']
-        except KeyError as error_handler:
-            raise KeyError(
-                'RELATIVE pressure units declared; must specify saturationPressure (in bar)'
-            ) from error_handler
-        try:
-            p_conversion = float(p_conversion)
-        except ValueError as error_handler:
-            raise ValueError(
-                'RELATIVE pressure units declared; must specify saturationPressure (in bar)'
-            ) from error_handler
-    else:
-        try:
-            p_conversion = pressure_units[
-                raw_units]  # conversion from raw_units to bar
-        except TypeError as error_handler:
-            raise TypeError('Unknown pressure units: ',
-                            raw_units) from error_handler
-    try:
-        log_scale = isotherm['log_scale']
-    except KeyError:
-        log_scale = False
-    for point in isotherm['isotherm_data']:
-        if log_scale:
-            # Convert from log (assume base-10) to bar pressure
+        # Convert pressure to bar units
+        raw_units = isotherm['pressureUnits']
+        if raw_units == 'RELATIVE':
+            try:
+                p_conversion = isotherm['saturationPressure']
+            except KeyError as error_handler:
+                raise KeyError(
+                    'RELATIVE pressure units declared; must specify saturationPressure (in bar)'
+                ) from error_handler
             try:
-                point['pressure'] = (10.0**point['pressure']) * p_conversion
+                p_conversion = float(p_conversion)
             except ValueError as error_handler:
                 raise ValueError(
-                    'ERROR: unable to convert log-scale pressure: ',
-                    point['pressure']) from error_handler
+                    'RELATIVE pressure units declared; must specify saturationPressure (in bar)'
+                ) from error_handler
+        else:
+            # conversion from raw_units to bar
+            p_conversion = unit_registry().pressure_factor(raw_units)
+        try:
+            log_scale = isotherm['log_scale']
+        except KeyError:
+            log_scale = False
+        # Vectorized conversion of the isotherm points
+        pressure, adsorption, _ = isotherm_arrays(isotherm['isotherm_data'])
+        if log_scale:
+            # Convert from log (assume base-10) to bar pressure
+            pressure = np.power(10.0, pressure) * p_conversion
         else:
             # Otherwise, just convert bar pressure
-            point['pressure'] = point['pressure'] * p_conversion
-    isotherm['pressureUnits'] = 'bar'
-    # Map the adsorptionUnits to the default value
-    isotherm['adsorptionUnits'] = default_adsorption_units(
-        isotherm['adsorptionUnits'])
-    # Convert the tabular_data boolean variable to integer (SQL does not support boolean)
-    if isotherm['tabular_data'] is True:
-        isotherm['tabular_data'] = 1
-    elif isotherm['tabular_data'] is False:
-        isotherm['tabular_data'] = 0
-    elif isotherm['tabular_data'] != 0 and isotherm['tabular_data'] != 1:
-        raise ValueError(
-            "ERROR: 'tabular_data' field does not conform to either (0,1) or (False,True)"
-        )
-
-    # Trim out points with invalid pressure or adsorption
-    new_points = []
-    for point in isotherm['isotherm_data']:
-        yvalues = [species['adsorption'] for species in point['species_data']]
-        #  Include points with pressure >= 0. or adsorption >= 0.
-        if point['pressure'] >= 0.0 and min(yvalues) >= 0.0:
+            pressure = pressure * p_conversion
+        # Trim out points with invalid pressure or adsorption
+        #  Include points with pressure >= 0. and adsorption >= 0.
+        missing = np.isnan(adsorption)
+        lowest = np.amin(np.where(missing, np.inf, adsorption),
+                         axis=1,
+                         initial=np.inf)
+        valid = (pressure >= 0.0) & (lowest >= 0.0) & ~missing.all(axis=1)
+        new_points = []
+        for i in np.flatnonzero(valid):
+            point = isotherm['isotherm_data'][i]
+            point['pressure'] = float(pressure[i])
             new_points.append(point)
-    isotherm['isotherm_data'] = new_points
-    # Point Fixes
-    for key in isotherm:
-        if isotherm[key] is None:
-            isotherm[key] = ''
-    if isotherm['tabular_data']:
-        isotherm['tabular_data'] = 1
-    else:
-        isotherm['tabular_data'] = 0
-    # Clean up unnecessary keys
-    for key in copy.copy(isotherm):
-        if key not in canonical_keys:
-            del isotherm[key]
-    # We're finally done, output!
-    # isotherm['filename'] = 'newfile.json'
-    # json_writer('newfile.json', isotherm)
-    isotherm['filename'] = filename.replace('.json', '')
+        isotherm['isotherm_data'] = new_points
+        isotherm['pressureUnits'] = 'bar'
+        # Map the adsorptionUnits to the default value
+        isotherm['adsorptionUnits'] = default_adsorption_units(
+            isotherm['adsorptionUnits'])
+        # tabular_data as 0/1, None as '', unnecessary keys dropped
+        isotherm = normalizer.finalize(
+            isotherm,
+            os.path.basename(filename).replace('.json', ''))
     json_writer('./JSON_PACKAGE/' + isotherm['filename'] + '.json', isotherm)
     #print('after')
     #pprint.pprint(isotherm)
+
+
+# Reference tables shared with the post_process_batch worker processes
+BATCH_TABLES = {}
+
+
+def init_post_process_worker(snapshot, adsorbate_inchikeys):
+    """Install the reference tables fetched by the parent process"""
+    drain()  # totals inherited from the parent (fork) are not ours
+    SNAPSHOT_CACHE.update(snapshot)
+    BATCH_TABLES['adsorbate_inchikeys'] = adsorbate_inchikeys
+
+
+def post_process_worker(filename):
+    """Post-process one file
+
+    Returns the filename, the error message on failure (or None) and the
+    instrumentation totals of the call.
+    """
+    error = None
+    try:
+        post_process(filename,
+                     adsorbate_inchikeys=BATCH_TABLES['adsorbate_inchikeys'])
+        count('items.completed')
+    except Exception as error_handler:  # pylint: disable=broad-except
+        # Any failure is recorded; one bad file must not stop the batch
+        count('items.failed')
+        error = repr(error_handler)
+    return filename, error, drain()
+
+
+def post_process_batch(pattern, workers=None):
+    """Post-process a folder (or glob pattern) of isotherms on a process pool
+
+    Reference tables are fetched once and shared with the workers. Failures
+    do not stop the batch; returns a {filename: error or None} summary.
+    """
+    if os.path.isdir(pattern):
+        filenames = sorted(glob.glob(os.path.join(pattern, '*.json')))
+    else:
+        filenames = sorted(glob.glob(pattern))
+    print(len(filenames), 'Isotherm Files')
+    if not os.path.exists('./JSON_PACKAGE'):
+        os.mkdir('./JSON_PACKAGE')
+
+    # Fetch the reference tables once for the whole run
+    tables = (dict(reference_snapshot()), known_adsorbate_inchikeys())
+    # Compiled once here, inherited by forked workers
+    unit_registry()
+    isotherm_normalizer()
+    with multiprocessing.Pool(workers,
+                              initializer=init_post_process_worker,
+                              initargs=tables) as pool:
+        summary = {}
+        for filename, error, totals in pool.imap(post_process_worker,
+                                                 filenames):
+            summary[filename] = error
+            merge(totals)
+
+    # Per-file summary
+    failures = 0
+    for filename, error in summary.items():
+        if error is None:
+            print('OK     ', filename)
+        else:
+            failures += 1
+            print('FAILED ', filename, error)
+    print(len(summary) - failures, 'succeeded,', failures, 'failed')
+    return summary
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Module to provide hashed matching of journal names
+
+Only exact matches of the normalized name or abbreviation are accepted;
+trigram similarity only ranks candidates for journals that do not match.
+"""
+import re
+import unicodedata
+import collections
+
+from .config import CANONICALIZE
+
+NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_journal(name):
+    """Normalize a journal name or abbreviation for matching
+
+    Unifies Unicode form (NFKC), case, diacritics, '&'/'and', punctuation,
+    whitespace and a leading 'the'.
+    """
+    text = unicodedata.normalize(CANONICALIZE, name).casefold()
+    text = ''.join(x for x in unicodedata.normalize('NFKD', text)
+                   if not unicodedata.combining(x))
+    text = NON_WORD.sub(' ', text.replace('&', ' and '))
+    words = text.split()
+    if words and words[0] == 'the':
+        words = words[1:]
+    return ' '.join(words)
+
+
+def trigrams(key):
+    """Set of character trigrams of a normalized name"""
+    padded = '  ' + key + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class JournalIndex:
+    """Journal lookup built once from the ISODB journals-lookup table
+
+    Names and abbreviations are hashed by their normalized form, with
+    `fixes` (raw name -> ISODB name) applied as aliases. Names that do not
+    match exactly can be ranked by trigram similarity.
+    """
+    def __init__(self, journals, fixes=None):
+        self.journals = journals
+        self.names = {}
+        self.abbreviations = {}
+        for position, journal in enumerate(journals):
+            # The first journal with a given key wins, as with list.index()
+            self.names.setdefault(normalize_journal(journal['name']), position)
+            if journal.get('abbreviation'):
+                self.abbreviations.setdefault(
+                    normalize_journal(journal['abbreviation']), position)
+        self.fixes = {}
+        for raw, fixed in (fixes or {}).items():
+            self.fixes[normalize_journal(raw)] = normalize_journal(fixed)
+
+        # Inverted trigram index for ranking candidates
+        self.sizes = {}
+        self.postings = collections.defaultdict(list)
+        for kind, table in (('name', self.names), ('abbreviation',
+                                                   self.abbreviations)):
+            for key, position in table.items():
+                grams = trigrams(key)
+                self.sizes[(kind, key)] = len(grams)
+                for gram in grams:
+                    self.postings[gram].append((kind, key))
+
+    def lookup(self, journal):
+        """Exact match of a journal name/abbreviation
+
+        Returns (position, kind) with kind 'name' or 'abbreviation', or None.
+        """
+        key = normalize_journal(journal)
+        key = self.fixes.get(key, key)
+        if key in self.names:
+            return self.names[key], 'name'
+        if key in self.abbreviations:
+            return self.abbreviations[key], 'abbreviation'
+        return None
+
+    def candidates(self, journal, limit=5):
+        """Journals ranked by trigram (Jaccard) similarity to `journal`
+
+        Returns a list of (score, position, kind), best match first.
+        """
+        grams = trigrams(normalize_journal(journal))
+        shared = collections.Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        scores = {}
+        for (kind, key), count in shared.items():
+            score = count / float(len(grams) + self.sizes[(kind, key)] - count)
+            position = (self.names
+                        if kind == 'name' else self.abbreviations)[key]
+            if score > scores.get(position, (0.0, kind))[0]:
+                scores[position] = (score, kind)
+        ranked = sorted(((score, position, kind)
+                         for position, (score, kind) in scores.items()),
+                        key=lambda x: (-x[0], x[1]))
+        return ranked[:limit]
+
+    def reference(self, position, kind):
+        """Journal block for a bibliography entry"""
+        journal = {'journal_id': self.journals[position]['id']}
+        journal[kind] = self.journals[position][kind]
+        return journal
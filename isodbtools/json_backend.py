@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Module to provide fast JSON serialization matching the ISODB format byte for byte
+
+The ISODB format is the output of the stdlib encoder with
+ensure_ascii=False, sort_keys=True and indent=4, plus a trailing newline.
+With indent, the stdlib always falls back to its pure-Python encoder; when
+orjson is installed it is used instead and its output re-indented, for any
+data it is known to format identically. Everything else goes through the
+stdlib encoder.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+# Types orjson and the stdlib encoder format identically (floats are checked)
+PLAIN_TYPES = (str, int, bool, type(None))
+
+
+def stdlib_serialize(data):
+    """Serialize with the stdlib encoder (the reference ISODB format)"""
+    return json.dumps(data, ensure_ascii=False, sort_keys=True,
+                      indent=4) + '\n'
+
+
+def orjson_compatible(data):
+    """Check that orjson formats every value in `data` like the stdlib
+
+    Floats must be finite and in the range the stdlib writes without an
+    exponent (0 or 1e-4 <= |x| < 1e16); containers must be plain dicts and
+    lists/tuples.
+    """
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        kind = type(value)
+        if kind is dict:
+            stack.extend(value.values())
+        elif kind is list or kind is tuple:
+            stack.extend(value)
+        elif kind is float:
+            if value != 0.0 and not 1.0e-4 <= abs(value) < 1.0e16:
+                return False  # also rejects NaN and infinities
+        elif kind not in PLAIN_TYPES:
+            return False
+    return True
+
+
+def orjson_serialize(data):
+    """Serialize with orjson, or return None if the output could differ"""
+    # pylint: disable-msg=no-member
+    if orjson is None or not orjson_compatible(data):
+        return None
+    try:
+        encoded = orjson.dumps(data,
+                               option=orjson.OPT_INDENT_2
+                               | orjson.OPT_SORT_KEYS)
+    except TypeError:  # e.g. non-string keys, integers beyond 64 bits
+        return None
+    # Re-indent from 2 to 4 spaces, deepest level first. NUL never appears
+    # unescaped in JSON, so it marks lines that have already been converted.
+    depth = 0
+    while encoded.find(b'\n' + b'  ' * (depth + 1)) != -1:
+        depth += 1
+    for level in range(depth, 0, -1):
+        encoded = encoded.replace(b'\n' + b'  ' * level, b'\n' + b'\0' * level)
+    return encoded.replace(b'\0', b'    ').decode('utf-8') + '\n'
+
+
+def serialize(data, backend='auto', verify=False):
+    """Serialize `data` in the ISODB format
+
+    backend: 'auto' (orjson when installed and safe), 'orjson' (same, but
+    an error if orjson is missing) or 'stdlib'. With `verify`, the result is
+    checked against the stdlib encoder and a ValueError raised on mismatch.
+    """
+    if backend == 'stdlib':
+        return stdlib_serialize(data)
+    if backend == 'orjson' and orjson is None:
+        raise ImportError('JSON backend orjson requested but not installed')
+    text = orjson_serialize(data)
+    if text is None:
+        return stdlib_serialize(data)
+    if verify and text != stdlib_serialize(data):
+        raise ValueError('JSON backend output differs from the stdlib encoder')
+    return text
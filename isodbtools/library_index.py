@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Module to provide an SQLite query index over the mirrored isotherm library
+"""
+import os
+import json
+import sqlite3
+
+from .config import JSON_FOLDER, LIBRARY_INDEX_NAME, LIBRARY_REFERENCE_FOLDERS
+
+INDEX_SCHEMA = [
+    'PRAGMA foreign_keys = ON',
+    'CREATE TABLE IF NOT EXISTS isotherms ('
+    ' id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL,'
+    ' mtime REAL, size INTEGER, filename TEXT, doi TEXT,'
+    ' adsorbent_hashkey TEXT, adsorbent_name TEXT, temperature REAL,'
+    ' category TEXT, isotherm_type TEXT, adsorption_units TEXT,'
+    ' pressure_units TEXT, pressure_min REAL, pressure_max REAL,'
+    ' num_points INTEGER)',
+    'CREATE TABLE IF NOT EXISTS adsorbates ('
+    ' isotherm_id INTEGER NOT NULL REFERENCES isotherms(id) ON DELETE CASCADE,'
+    ' inchikey TEXT, name TEXT)',
+    'CREATE INDEX IF NOT EXISTS isotherms_adsorbent ON isotherms(adsorbent_hashkey)',
+    'CREATE INDEX IF NOT EXISTS isotherms_temperature ON isotherms(temperature)',
+    'CREATE INDEX IF NOT EXISTS isotherms_category ON isotherms(category)',
+    'CREATE INDEX IF NOT EXISTS isotherms_doi ON isotherms(doi COLLATE NOCASE)',
+    'CREATE INDEX IF NOT EXISTS isotherms_pressure ON isotherms(pressure_min, pressure_max)',
+    'CREATE INDEX IF NOT EXISTS adsorbates_inchikey ON adsorbates(inchikey, isotherm_id)',
+    'CREATE INDEX IF NOT EXISTS adsorbates_name ON adsorbates(name COLLATE NOCASE, isotherm_id)',
+    'CREATE INDEX IF NOT EXISTS adsorbates_isotherm ON adsorbates(isotherm_id)',
+]
+
+
+def iter_library_files(folder=JSON_FOLDER):
+    """Yield (path, stat) for every isotherm file in the DOI folders of a library"""
+    with os.scandir(folder) as doi_folders:
+        for doi_folder in sorted(doi_folders, key=lambda x: x.name):
+            if not doi_folder.is_dir(
+            ) or doi_folder.name in LIBRARY_REFERENCE_FOLDERS:
+                continue
+            with os.scandir(doi_folder.path) as entries:
+                for entry in sorted(entries, key=lambda x: x.name):
+                    if entry.name.endswith('.json') and entry.is_file():
+                        yield entry.path, entry.stat()
+
+
+def isotherm_metadata(isotherm):
+    """Metadata row (without path/mtime/size) and adsorbates of an isotherm"""
+    pressures = [point['pressure'] for point in isotherm['isotherm_data']]
+    adsorbent = isotherm.get('adsorbent', {})
+    row = (isotherm.get('filename'), isotherm.get('DOI'),
+           adsorbent.get('hashkey'), adsorbent.get('name'),
+           isotherm.get('temperature'), isotherm.get('category'),
+           isotherm.get('isotherm_type'), isotherm.get('adsorptionUnits'),
+           isotherm.get('pressureUnits'), min(pressures, default=None),
+           max(pressures, default=None), len(pressures))
+    adsorbates = [(x.get('InChIKey'), x.get('name'))
+                  for x in isotherm.get('adsorbates', [])]
+    return row, adsorbates
+
+
+class LibraryIndex:
+    """SQLite index of the isotherm metadata in a mirrored library
+
+    `update` re-reads only files whose mtime or size changed since the last
+    run; `query` answers metadata searches from the index alone. The database
+    is `path`, by default LIBRARY_INDEX_NAME in the library folder.
+    """
+    def __init__(self, path=None, folder=JSON_FOLDER):
+        if path is None:
+            path = os.path.join(folder, LIBRARY_INDEX_NAME)
+        self.path = path
+        self.folder = folder
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        for statement in INDEX_SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def close(self):
+        """Close the index database"""
+        self.connection.close()
+
+    def update(self):
+        """Bring the index up to date with the library folder
+
+        Returns a dict with counts of added, updated, removed and unchanged
+        files.
+        """
+        known = {
+            row['path']: (row['id'], row['mtime'], row['size'])
+            for row in self.connection.execute(
+                'SELECT id, path, mtime, size FROM isotherms')
+        }
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        with self.connection:
+            for filename, stat in iter_library_files(self.folder):
+                path = os.path.relpath(filename,
+                                       self.folder).replace(os.sep, '/')
+                previous = known.pop(path, None)
+                if previous is not None and previous[1:] == (stat.st_mtime,
+                                                             stat.st_size):
+                    counts['unchanged'] += 1
+                    continue
+                with open(filename, mode='r', encoding='utf-8') as handle:
+                    row, adsorbates = isotherm_metadata(json.load(handle))
+                if previous is not None:
+                    self.connection.execute('DELETE FROM isotherms WHERE id=?',
+                                            (previous[0], ))
+                    counts['updated'] += 1
+                else:
+                    counts['added'] += 1
+                cursor = self.connection.execute(
+                    'INSERT INTO isotherms (path, mtime, size, filename, doi,'
+                    ' adsorbent_hashkey, adsorbent_name, temperature,'
+                    ' category, isotherm_type, adsorption_units,'
+                    ' pressure_units, pressure_min, pressure_max, num_points)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (path, stat.st_mtime, stat.st_size) + row)
+                self.connection.executemany(
+                    'INSERT INTO adsorbates VALUES (?, ?, ?)',
+                    [(cursor.lastrowid, ) + x for x in adsorbates])
+            # Files no longer in the library
+            self.connection.executemany('DELETE FROM isotherms WHERE id=?',
+                                        [(x[0], ) for x in known.values()])
+            counts['removed'] = len(known)
+        return counts
+
+    def query(self,
+              adsorbate=None,
+              adsorbent=None,
+              adsorbent_name=None,
+              temperature=None,
+              temperature_tolerance=0.5,
+              category=None,
+              pressure=None,
+              doi=None):
+        # pylint: disable-msg=too-many-arguments
+        """Find isotherms by metadata; returns a list of dictionaries
+
+        adsorbate: InChIKey or name (case-insensitive) of any adsorbate
+        adsorbent: adsorbent hashkey
+        adsorbent_name: SQL LIKE pattern on the adsorbent name (e.g. '%zeolite%')
+        temperature: K, matched within +/- temperature_tolerance
+        category: isotherm category (e.g. 'exp', 'sim')
+        pressure: a pressure (bar) within the isotherm's measured range
+        doi: DOI (case-insensitive)
+        """
+        clauses = []
+        values = []
+        if adsorbate is not None:
+            clauses.append(
+                'id IN (SELECT isotherm_id FROM adsorbates WHERE inchikey=?'
+                ' UNION SELECT isotherm_id FROM adsorbates'
+                ' WHERE name=? COLLATE NOCASE)')
+            values += [adsorbate, adsorbate]
+        if adsorbent is not None:
+            clauses.append('adsorbent_hashkey=?')
+            values.append(adsorbent)
+        if adsorbent_name is not None:
+            clauses.append('adsorbent_name LIKE ?')
+            values.append(adsorbent_name)
+        if temperature is not None:
+            clauses.append('temperature BETWEEN ? AND ?')
+            values += [
+                temperature - temperature_tolerance,
+                temperature + temperature_tolerance
+            ]
+        if category is not None:
+            clauses.append('category=?')
+            values.append(category)
+        if pressure is not None:
+            clauses.append('pressure_min<=? AND pressure_max>=?')
+            values += [pressure, pressure]
+        if doi is not None:
+            clauses.append('doi=? COLLATE NOCASE')
+            values.append(doi)
+        sql = 'SELECT * FROM isotherms'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        results = []
+        for row in self.connection.execute(sql + ' ORDER BY path', values):
+            result = dict(row)
+            result['adsorbates'] = [
+                dict(x) for x in self.connection.execute(
+                    'SELECT inchikey, name FROM adsorbates'
+                    ' WHERE isotherm_id=?', (row['id'], ))
+            ]
+            results.append(result)
+        return results
+
+
+def index_library(folder=JSON_FOLDER, path=None):
+    """Build or incrementally update the SQLite index of a library
+
+    path: index database (default: LIBRARY_INDEX_NAME in `folder`)
+    """
+    index = LibraryIndex(path, folder)
+    try:
+        counts = index.update()
+    finally:
+        index.close()
+    print(counts['added'], 'added,', counts['updated'], 'updated,',
+          counts['removed'], 'removed,', counts['unchanged'], 'unchanged')
+    return counts
+
+
+def query_library(path=None, folder=JSON_FOLDER, **criteria):
+    """Query the library index (see LibraryIndex.query for the criteria)"""
+    index = LibraryIndex(path, folder)
+    try:
+        return index.query(**criteria)
+    finally:
+        index.close()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Module to provide a resumable download manifest for library regeneration
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+from .config import JSON_FOLDER, MANIFEST_PATH, DOWNLOAD_RETRIES, DOWNLOAD_RETRY_DELAY
+from .throttle import run_tasks
+from .instrumentation import count
+
+MANIFEST_VERSION = 1
+
+
+def file_checksum(filename):
+    """SHA-256 checksum of a file on disk"""
+    digest = hashlib.sha256()
+    with open(filename, mode='rb') as handle:
+        for block in iter(lambda: handle.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadManifest:
+    """Record of library items that finished (or failed) downloading
+
+    Items are keyed by their path relative to JSON_FOLDER. Completed items
+    store their size and SHA-256 checksum; failed items store the URL and
+    error so they can be retried by a later run.
+    """
+    def __init__(self, path=MANIFEST_PATH, flush_every=100):
+        self.path = path
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.completed = {}
+        self.failed = {}
+        if os.path.exists(path):
+            with open(path, mode='r', encoding='utf-8') as handle:
+                data = json.load(handle)
+            if data.get('version') == MANIFEST_VERSION:
+                self.completed = data['completed']
+                self.failed = data['failed']
+
+    @staticmethod
+    def key(filename):
+        """Manifest key (path relative to JSON_FOLDER) for an output file"""
+        return os.path.relpath(filename, JSON_FOLDER).replace(os.sep, '/')
+
+    def is_complete(self, filename):
+        """Check that an item finished and is still intact on disk
+
+        The size is compared first; the SHA-256 checksum is only computed for
+        files of the recorded size.
+        """
+        entry = self.completed.get(self.key(filename))
+        if entry is None:
+            return False
+        try:
+            return (os.path.getsize(filename) == entry['size']
+                    and file_checksum(filename) == entry['sha256'])
+        except OSError:
+            return False
+
+    def record_success(self, filename):
+        """Mark an item as completed"""
+        entry = {
+            'size': os.path.getsize(filename),
+            'sha256': file_checksum(filename),
+            'time': time.time()
+        }
+        key = self.key(filename)
+        count('items.completed')
+        with self.lock:
+            self.completed[key] = entry
+            self.failed.pop(key, None)
+            self._count_write()
+
+    def record_failure(self, filename, url, error):
+        """Mark an item as failed, queueing it for a retry"""
+        key = self.key(filename)
+        count('items.failed')
+        with self.lock:
+            self.completed.pop(key, None)
+            self.failed[key] = {'url': url, 'error': repr(error)}
+            self._count_write()
+
+    def forget(self, filename):
+        """Drop an item (e.g. withdrawn upstream) from the manifest"""
+        key = self.key(filename)
+        with self.lock:
+            self.completed.pop(key, None)
+            self.failed.pop(key, None)
+            self._count_write()
+
+    def _count_write(self):
+        self.pending_writes += 1
+        if self.pending_writes >= self.flush_every:
+            self._write()
+
+    def _write(self):
+        data = {
+            'version': MANIFEST_VERSION,
+            'completed': self.completed,
+            'failed': self.failed
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', mode='w', encoding='utf-8') as output:
+            json.dump(data, output, sort_keys=True, indent=1)
+            output.write('\n')
+        os.replace(self.path + '.tmp', self.path)
+        self.pending_writes = 0
+
+    def save(self):
+        """Write the manifest to disk (atomically)"""
+        with self.lock:
+            self._write()
+
+
+def run_resumable(task,
+                  items,
+                  manifest,
+                  resume=False,
+                  workers=1,
+                  limiter=None,
+                  retries=DOWNLOAD_RETRIES):
+    # pylint: disable-msg=too-many-arguments
+    """Run download tasks, recording every outcome in the manifest
+
+    Items are tuples ending in (url, filename); `task(item)` downloads and
+    writes one item. With `resume`, items already completed are skipped.
+    Failures do not abort the run: they are reported, queued and retried
+    up to `retries` times after the first pass. Yields (item, error) for the
+    first pass in input order, with error None for completed items.
+    """
+    def guarded(item):
+        url, filename = item[-2:]
+        if resume and manifest.is_complete(filename):
+            count('items.skipped')
+            return None
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            task(item)
+        except (OSError, ValueError, KeyError, IndexError,
+                TypeError) as error_handler:
+            manifest.record_failure(filename, url, error_handler)
+            print('ERROR: ', url, error_handler)
+            return error_handler
+        manifest.record_success(filename)
+        return None
+
+    retry_queue = []
+    try:
+        for item, error in run_tasks(guarded, items, workers=workers):
+            if error is not None:
+                retry_queue.append(item)
+            yield item, error
+
+        for attempt in range(1, retries + 1):
+            if not retry_queue:
+                break
+            print('Retrying', len(retry_queue), 'failed items, attempt',
+                  attempt)
+            time.sleep(DOWNLOAD_RETRY_DELAY * attempt)
+            retry_queue = [
+                item for item, error in run_tasks(
+                    guarded, retry_queue, workers=workers) if error is not None
+            ]
+    finally:
+        manifest.save()
+
+    if retry_queue:
+        print(len(retry_queue), 'items failed; rerun with --resume to retry')
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Module to provide the isotherm metadata normalizer used by post_process
+
+The API key mapping tables (MAPS), the canonical keys and the
+tabular_data/None fix-up rules are compiled once into hashed lookups, so
+normalizing the metadata of an isotherm takes a few dictionary lookups and
+one pass over its keys.
+"""
+from .config import canonical_keys
+from .reference_maps import MAPS, reference_snapshot
+
+# Normalizer compiled from the current snapshot (see isotherm_normalizer)
+NORMALIZER = {}
+
+
+def compile_map(table):
+    """Lowercase name -> translation of a key mapping table
+
+    The translation is the value left by applying the table entries in order
+    (each matching the current value case-insensitively), as the original
+    scan over the table did.
+    """
+    translations = {}
+    for item in table:
+        start = item['name'].lower()
+        if start in translations:
+            continue
+        value = start
+        for rule in table:
+            if value.lower() == rule['name'].lower():
+                value = rule['shortname']
+        translations[start] = value
+    return translations
+
+
+class IsothermNormalizer:
+    """Metadata normalization of isotherms compiled from the API maps"""
+    def __init__(self, maps):
+        self.maps = {key: compile_map(table) for key, table in maps.items()}
+        self.keys = frozenset(canonical_keys)
+
+    def translate(self, isotherm):
+        """First pass: translate the mapped keys to the API shortnames"""
+        for key, translations in self.maps.items():
+            if translations:
+                value = isotherm[key]
+                isotherm[key] = translations.get(value.lower(), value)
+        return isotherm
+
+    def finalize(self, isotherm, filename):
+        """Last pass: tabular_data as 0/1, None as '', canonical keys only
+
+        Returns a new dictionary with `filename` set.
+        """
+        tabular_data = isotherm['tabular_data']
+        if tabular_data not in (0, 1):  # True/False compare equal to 1/0
+            raise ValueError(
+                "ERROR: 'tabular_data' field does not conform to either (0,1) or (False,True)"
+            )
+        output = {
+            key: '' if value is None else value
+            for key, value in isotherm.items() if key in self.keys
+        }
+        # Convert the tabular_data boolean variable to integer (SQL does not support boolean)
+        output['tabular_data'] = 1 if tabular_data else 0
+        output['filename'] = filename
+        return output
+
+
+def isotherm_normalizer():
+    """The normalizer of the current API reference snapshot (compiled once)"""
+    revision = reference_snapshot().get('revision')
+    if NORMALIZER.get(
+            'revision') != revision or 'normalizer' not in NORMALIZER:
+        NORMALIZER['normalizer'] = IsothermNormalizer(
+            {key: MAPS[key]['json']
+             for key in MAPS})
+        NORMALIZER['revision'] = revision
+    return NORMALIZER['normalizer']
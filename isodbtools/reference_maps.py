@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Module to provide the offline snapshot of the API reference maps
+"""
+import os
+import json
+import time
+import collections.abc
+
+from .config import API_HOST, SNAPSHOT_PATH, SNAPSHOT_VERSION, SNAPSHOT_CACHE, KEYS_API_MAPPING, \
+    UNITS_API_MAPPING, json_writer
+from .http_client import api_url, get_json
+
+
+def refresh_maps(path=SNAPSHOT_PATH):
+    """Download the API reference maps and save them as a new snapshot"""
+    revision = 0
+    if os.path.exists(path):
+        with open(path, mode='r', encoding='utf-8') as handle:
+            revision = json.load(handle).get('revision', 0)
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'revision': revision + 1,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'api_host': API_HOST,
+        'maps': {},
+        'adsorption_units': {}
+    }
+    for item, url in KEYS_API_MAPPING.items():
+        snapshot['maps'][item] = get_json(api_url('/isodb/api' + url),
+                                          headers={})
+    for item, url in UNITS_API_MAPPING.items():
+        snapshot['adsorption_units'][item] = get_json(
+            api_url('/isodb/api' + url, api_tracking=False))
+    # Write atomically so concurrent readers never see a partial snapshot
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    json_writer(path + '.tmp', snapshot)
+    os.replace(path + '.tmp', path)
+    SNAPSHOT_CACHE.clear()
+    SNAPSHOT_CACHE.update(snapshot)
+    return snapshot
+
+
+def reference_snapshot(path=SNAPSHOT_PATH, offline=False):
+    """Return the API reference snapshot, loading it on first use
+
+    A missing or outdated snapshot is downloaded once and saved to disk
+    (with `offline`, None is returned instead).
+    """
+    if not SNAPSHOT_CACHE:
+        snapshot = None
+        if os.path.exists(path):
+            with open(path, mode='r', encoding='utf-8') as handle:
+                snapshot = json.load(handle)
+        if snapshot is None or snapshot.get('version') != SNAPSHOT_VERSION:
+            if offline:
+                return None
+            print('No API reference snapshot, downloading to', path)
+            snapshot = refresh_maps(path)
+        SNAPSHOT_CACHE.update(snapshot)
+    return SNAPSHOT_CACHE
+
+
+class LazyMaps(collections.abc.Mapping):
+    """Key mapping tables of the API, read from the snapshot on first use"""
+    def __getitem__(self, key):
+        return {'json': reference_snapshot()['maps'][key]}
+
+    def __iter__(self):
+        return iter(reference_snapshot()['maps'])
+
+    def __len__(self):
+        return len(reference_snapshot()['maps'])
+
+
+MAPS = LazyMaps()
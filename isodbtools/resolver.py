@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Module to provide cached resolution of adsorbate/adsorbent names
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+import collections
+
+from .instrumentation import count
+from .config import RESOLVER_CACHE_PATH, RESOLVER_TTL, RESOLVER_NEGATIVE_TTL, RESOLVER_LRU_SIZE
+
+
+class Flight:
+    # pylint: disable-msg=too-few-public-methods
+    """A lookup in progress, shared by every thread asking for the same name"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class NameResolver:
+    # pylint: disable-msg=too-many-instance-attributes
+    """Resolve names through an in-process LRU backed by a persistent store
+
+    `fetch(name)` performs the API lookup and returns a dict, or None only if
+    the API reports the name as not found. Unknown names are cached too (with a shorter TTL), and
+    concurrent lookups of the same name share a single fetch. Errors raised
+    by `fetch` (e.g. network failures) are not cached.
+    """
+    def __init__(self,
+                 namespace,
+                 fetch,
+                 path=RESOLVER_CACHE_PATH,
+                 ttl=RESOLVER_TTL,
+                 negative_ttl=RESOLVER_NEGATIVE_TTL,
+                 maxsize=RESOLVER_LRU_SIZE):
+        # pylint: disable-msg=too-many-arguments
+        self.namespace = namespace
+        self.fetch = fetch
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self.memory = collections.OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.connection = None
+        self.connection_pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def database(self):
+        """Open the persistent store (once per process)"""
+        if self.connection is None or self.connection_pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.connection = sqlite3.connect(self.path,
+                                              timeout=30.0,
+                                              check_same_thread=False)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS names (namespace TEXT, name TEXT, '
+                'value TEXT, expires REAL, PRIMARY KEY (namespace, name))')
+            self.connection.commit()
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    def load_stored(self, key):
+        """Read a cached resolution from the persistent store"""
+        with self.db_lock:
+            row = self.database().execute(
+                'SELECT value, expires FROM names WHERE namespace=? AND name=?',
+                (self.namespace, key)).fetchone()
+        if row is None or row[1] < time.time():
+            return False, None, 0.0
+        return True, json.loads(row[0]), row[1]
+
+    def store(self, key, value, expires):
+        """Write a resolution to the persistent store"""
+        with self.db_lock:
+            connection = self.database()
+            connection.execute(
+                'INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)',
+                (self.namespace, key, json.dumps(value), expires))
+            connection.commit()
+
+    def remember(self, key, value, expires):
+        """Add a resolution to the in-process LRU (lock held by caller)"""
+        self.memory[key] = (value, expires)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def peek(self, name):
+        """Cached resolution of `name`, without any API request
+
+        Returns (found, value); value is None for names cached as unknown.
+        """
+        key = name.lower()
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached is not None and cached[1] >= time.time():
+                return True, cached[0]
+        found, value, _ = self.load_stored(key)
+        return found, value
+
+    def resolve(self, name):
+        """Return the resolution of `name` (None if the name is unknown)"""
+        key = name.lower()
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached is not None and cached[1] >= time.time():
+                self.memory.move_to_end(key)
+                self.hits += 1
+                count('cache.' + self.namespace + '.hits')
+                return cached[0]
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[key] = Flight()
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            found, value, expires = self.load_stored(key)
+            if not found:
+                self.misses += 1
+                count('cache.' + self.namespace + '.misses')
+                value = self.fetch(name)
+                if value is None:
+                    expires = time.time() + self.negative_ttl
+                else:
+                    expires = time.time() + self.ttl
+                self.store(key, value, expires)
+            else:
+                self.hits += 1
+                count('cache.' + self.namespace + '.hits')
+            flight.value = value
+            with self.lock:
+                self.remember(key, value, expires)
+            return value
+        except Exception as error_handler:
+            flight.error = error_handler
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            flight.event.set()
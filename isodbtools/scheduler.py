@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Module to regenerate every library resource in one job under a shared request budget
+"""
+import collections
+
+from .config import API_RATE_LIMIT, API_WORKERS, REGENERATE_PRIORITIES
+from .throttle import make_limiter
+from .manifest import DownloadManifest, run_resumable
+from .doi_index import DoiIndex
+from .adsorbates_operations import adsorbate_tasks, download_adsorbate
+from .adsorbents_operations import adsorbent_tasks, download_adsorbent
+from .bibliography_operations import biblio_tasks, download_biblio
+from .isotherm_operations import isotherm_tasks, download_library_isotherm
+
+DOWNLOADS = {
+    'adsorbates': download_adsorbate,
+    'adsorbents': download_adsorbent,
+    'bibliography': download_biblio,
+    'isotherms': download_library_isotherm
+}
+
+
+def interleave(sources, priorities):
+    """Merge task streams by weighted round robin
+
+    sources: {name: iterable of task tuples}. Each round takes up to
+    priorities[name] tasks from every stream, highest priority first, until
+    all streams are exhausted. Yields (name,) + task.
+    """
+    active = sorted(sources, key=lambda x: -priorities[x])
+    for name in active:
+        if priorities[name] < 1:
+            raise ValueError('Priority of ' + name + ' must be at least 1')
+    iterators = {name: iter(sources[name]) for name in active}
+    while active:
+        for name in list(active):
+            for _ in range(priorities[name]):
+                task = next(iterators[name], None)
+                if task is None:
+                    active.remove(name)
+                    break
+                yield (name, ) + tuple(task)
+
+
+def regenerate_all(api_tracking=True,
+                   workers=API_WORKERS,
+                   rate_limit=API_RATE_LIMIT,
+                   resume=False,
+                   priorities=None):
+    # pylint: disable-msg=too-many-locals
+    """Regenerate adsorbates, adsorbents, bibliography and isotherms in one job
+
+    All downloads share one pool of `workers` threads and one token bucket
+    of `rate_limit` requests per second. Work is interleaved across the
+    resource types by `priorities` (tasks per round, see
+    REGENERATE_PRIORITIES), so the reference entities finish early while the
+    isotherms keep the remaining budget busy. Returns the first-pass
+    {resource: (completed, failed)} counts.
+    """
+    priorities = dict(REGENERATE_PRIORITIES, **(priorities or {}))
+    for name in priorities:
+        if name not in DOWNLOADS:
+            raise ValueError('Unknown resource: ' + name)
+    limiter = make_limiter(rate_limit)
+
+    # Bibliography files and isotherm folders share one DOI stub index
+    with DoiIndex() as doi_index:
+        listings = {}
+        sources = {}
+        listings['adsorbates'], sources['adsorbates'] = adsorbate_tasks(
+            api_tracking, limiter)
+        listings['adsorbents'], sources['adsorbents'] = adsorbent_tasks(
+            api_tracking, limiter)
+        listings['bibliography'], sources['bibliography'] = biblio_tasks(
+            doi_index, api_tracking, limiter)
+        listings['isotherms'], sources['isotherms'] = isotherm_tasks(
+            doi_index, api_tracking, limiter)
+
+        def download(task):
+            """Dispatch a task to the download function of its resource"""
+            DOWNLOADS[task[0]](task[1:])
+
+        completed = collections.Counter()
+        failed = collections.Counter()
+        for task, error in run_resumable(download,
+                                         interleave(sources, priorities),
+                                         DownloadManifest(),
+                                         resume=resume,
+                                         workers=workers,
+                                         limiter=limiter):
+            if error is None:
+                completed[task[0]] += 1
+            else:
+                failed[task[0]] += 1
+            if task[0] == 'isotherms' and task[2]:
+                print(task[1], 'Finished')
+
+    summary = {}
+    for name in sorted(sources, key=lambda x: -priorities[x]):
+        summary[name] = (completed[name], failed[name])
+        print(name + ':', listings[name].count, 'listed,', completed[name],
+              'downloaded,', failed[name], 'failed on the first pass')
+    return summary
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""Module to provide a local stand-in for the ISODB/MATDB and doi.org APIs
+
+The stand-in serves synthetic (or recorded) responses for every endpoint
+used by isodbtools, with configurable latency and error injection, so the
+library commands can be benchmarked and tested without the live API. Point
+isodbtools at it with the ISODB_API_HOST and ISODB_DOI_HOST environment
+variables (see `StandinServer.environment`).
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import collections
+import socketserver
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .config import TRACKER_SUFFIX, KEYS_API_MAPPING, UNITS_API_MAPPING
+
+# pylint: disable=consider-using-f-string
+
+# Path prefix under which the stand-in serves doi.org
+DOI_PREFIX = '/doi.org/'
+
+ADSORBATE_NAMES = [
+    'Carbon Dioxide', 'Methane', 'Nitrogen', 'Hydrogen', 'Argon', 'Oxygen',
+    'Ethane', 'Ethylene', 'Propane', 'Propylene', 'Water', 'Krypton', 'Xenon',
+    'Helium', 'Carbon Monoxide', 'Sulfur Dioxide'
+]
+JOURNAL_NAMES = [
+    ('Journal of Physical Chemistry C', 'J. Phys. Chem. C'),
+    ('Langmuir', 'Langmuir'),
+    ('Microporous and Mesoporous Materials', 'Microporous Mesoporous Mater.'),
+    ('Adsorption', 'Adsorption'),
+    ('Journal of the American Chemical Society', 'J. Am. Chem. Soc.'),
+    ('Chemical Engineering Journal', 'Chem. Eng. J.'),
+]
+
+
+def fake_inchikey(name):
+    """Well-formed, deterministic InChIKey for a synthetic adsorbate"""
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest().upper()
+    letters = ''.join(chr(ord('A') + int(x, 16) % 26) for x in digest)
+    return letters[:14] + '-' + letters[14:24] + '-N'
+
+
+def name_map(pairs):
+    """API key map ({'name', 'shortname'} entries) from (name, shortname) pairs"""
+    return [{
+        'name': name,
+        'shortname': shortname
+    } for name, shortname in pairs]
+
+
+def synthetic_isotherm(filename, doi, gas, material, pressures, temperature):
+    # pylint: disable-msg=too-many-arguments
+    """Single-component isotherm in the ISODB format (Langmuir-shaped)"""
+    isotherm = {}
+    isotherm['DOI'] = doi
+    isotherm['adsorbates'] = [{
+        'InChIKey': gas['InChIKey'],
+        'name': gas['name']
+    }]
+    isotherm['adsorbent'] = dict(material)
+    isotherm['adsorptionUnits'] = 'mmol/g'
+    isotherm['articleSource'] = 'Synthetic'
+    isotherm['category'] = 'exp'
+    isotherm['compositionType'] = 'molefraction'
+    isotherm['concentrationUnits'] = 'molefraction'
+    isotherm['date'] = '2020-01-01'
+    isotherm['digitizer'] = 'standin'
+    isotherm['filename'] = filename
+    isotherm['isotherm_data'] = []
+    for pressure in pressures:
+        adsorption = 5.0 * pressure / (1.0 + pressure)
+        species = {
+            'InChIKey': gas['InChIKey'],
+            'adsorption': adsorption,
+            'composition': 1.0
+        }
+        isotherm['isotherm_data'].append({
+            'pressure': pressure,
+            'species_data': [species],
+            'total_adsorption': adsorption
+        })
+    isotherm['isotherm_type'] = 'excess'
+    isotherm['pressureUnits'] = 'bar'
+    isotherm['tabular_data'] = 1
+    isotherm['temperature'] = temperature
+    return isotherm
+
+
+def synthetic_dataset(biblios=50,
+                      isotherms_per_biblio=4,
+                      adsorbents=40,
+                      points=20,
+                      seed=0):
+    # pylint: disable-msg=too-many-locals
+    """Generate a consistent synthetic API dataset
+
+    Returns a dictionary of API paths (without API_HOST) to JSON-compatible
+    responses. Isotherm files pass post_process unchanged.
+    """
+    rng = random.Random(seed)
+    routes = {}
+
+    # Reference maps and adsorption-unit lookups
+    maps = {
+        'isotherm_type': [('Excess', 'excess'), ('Absolute', 'absolute')],
+        'category': [('Experimental', 'exp'), ('Simulation', 'sim')],
+        'concentrationUnits': [('Mole Fraction', 'molefraction')],
+        'compositionType': [('Mole Fraction', 'molefraction')],
+        'pressureUnits': [('Bar', 'bar')]
+    }
+    for key, url in KEYS_API_MAPPING.items():
+        routes['/isodb/api' + url] = name_map(maps[key])
+    units = ['mmol/g', 'mol/kg', 'cm3(STP)/g', 'mg/g']
+    for url in UNITS_API_MAPPING.values():
+        routes['/isodb/api' + url] = [{
+            'id': i + 1,
+            'name': name
+        } for i, name in enumerate(units)]
+
+    # Adsorbates and adsorbents
+    gases = [{
+        'InChIKey': fake_inchikey(name),
+        'name': name,
+        'formula': name[:2].upper()
+    } for name in ADSORBATE_NAMES]
+    routes['/isodb/api/gases.json'] = [{
+        'InChIKey': x['InChIKey'],
+        'name': x['name']
+    } for x in gases]
+    for gas in gases:
+        routes['/isodb/api/gas/' + gas['InChIKey'] + '.json'] = gas
+        routes['/isodb/api/gas/' + gas['name'].lower() + '.json'] = gas
+    materials = []
+    for i in range(adsorbents):
+        hashkey = hashlib.md5(str(i).encode('utf-8')).hexdigest().upper()
+        materials.append({'hashkey': hashkey, 'name': 'Material ' + str(i)})
+    routes['/matdb/api/materials.json'] = materials
+    for material in materials:
+        routes['/matdb/api/material/' + material['hashkey'] +
+               '.json'] = material
+        routes['/matdb/api/material/' + material['name'].lower() +
+               '.json'] = material
+
+    # Journals, bibliography and isotherms
+    routes['/isodb/api/journals-lookup.json'] = [{
+        'id': i + 1,
+        'name': name,
+        'abbreviation': abbreviation
+    } for i, (name, abbreviation) in enumerate(JOURNAL_NAMES)]
+    biblio_listing = []
+    isotherm_listing = []
+    for i in range(biblios):
+        doi = '10.5555/isodb.bench.%04d' % i
+        journal = rng.choice(JOURNAL_NAMES)[0]
+        year = rng.randint(1990, 2020)
+        title = 'Synthetic adsorption study ' + str(i)
+        authors = [{
+            'family': 'Author' + str(j),
+            'given': 'A. B.'
+        } for j in range(rng.randint(1, 4))]
+        filenames = []
+        for j in range(isotherms_per_biblio):
+            filename = doi.replace('/', '') + '.Isotherm' + str(j + 1)
+            gas = rng.choice(gases)
+            material = rng.choice(materials)
+            pressures = sorted(rng.uniform(0.0, 50.0) for _ in range(points))
+            routes['/isodb/api/isotherm/' + filename +
+                   '.json'] = synthetic_isotherm(filename, doi, gas, material,
+                                                 pressures,
+                                                 rng.choice([273, 298, 313]))
+            filenames.append({'filename': filename})
+            isotherm_listing.append({'filename': filename, 'DOI': doi})
+        biblio = {
+            'DOI': doi,
+            'title': title,
+            'journal': journal,
+            'year': year,
+            'authors': [x['given'] + ' ' + x['family'] for x in authors],
+            'isotherms': filenames
+        }
+        biblio_listing.append(biblio)
+        routes['/isodb/api/biblio/' + doi + '.json'] = [biblio]
+        routes[DOI_PREFIX + doi] = {
+            'DOI': doi,
+            'title': title,
+            'container-title': journal,
+            'issued': {
+                'date-parts': [[year]]
+            },
+            'author': authors
+        }
+    routes['/isodb/api/biblio.json'] = biblio_listing
+    routes['/isodb/api/biblios.json'] = [{
+        'DOI': x['DOI'],
+        'title': x['title']
+    } for x in biblio_listing]
+    routes['/isodb/api/isotherms.json'] = isotherm_listing
+    return routes
+
+
+def load_recordings(folder):
+    """Recorded responses: every file below `folder` is served at its path"""
+    routes = {}
+    for root, _, files in os.walk(folder):
+        for name in files:
+            filename = os.path.join(root, name)
+            path = '/' + os.path.relpath(filename, folder).replace(os.sep, '/')
+            with open(filename, mode='rb') as handle:
+                routes[path] = handle.read()
+    return routes
+
+
+def route_name(path):
+    """Endpoint family of a request path (used for request counts)"""
+    if path.startswith(DOI_PREFIX):
+        return 'doi.org'
+    parts = path.split('/')
+    if len(parts) > 4:
+        return '/'.join(parts[:4]) + '/*'
+    return path
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Request handler serving the routes of a StandinServer"""
+    protocol_version = 'HTTP/1.1'  # keep-alive, as the live API
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def do_GET(self):
+        # pylint: disable-msg=invalid-name
+        """Serve a route, after the configured latency and error injection"""
+        path = self.path.split('?', 1)[0]
+        # isodbtools appends the tracker suffix without a '?'
+        if path.endswith(TRACKER_SUFFIX):
+            path = path[:-len(TRACKER_SUFFIX)]
+        path = urllib.parse.unquote(path)
+        status, body = self.server.respond(path)
+        self.send_response(status)
+        if status == 200:
+            self.send_header('Content-Type', 'application/json')
+        else:
+            self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable-msg=arguments-differ
+        """Silence the per-request log"""
+
+
+class StandinServer(socketserver.ThreadingMixIn, HTTPServer):
+    # pylint: disable-msg=too-many-instance-attributes
+    """Threaded HTTP stand-in for the ISODB API and doi.org
+
+    routes: API path -> response (JSON-compatible object or raw bytes);
+      defaults to `synthetic_dataset()`
+    latency: seconds added to every response, plus up to `jitter` seconds
+    error_rate: fraction of requests answered with `error_status`
+    Requests are counted per endpoint family in `counts`.
+    """
+    daemon_threads = True
+
+    def __init__(self,
+                 routes=None,
+                 address=('127.0.0.1', 0),
+                 latency=0.0,
+                 jitter=0.0,
+                 error_rate=0.0,
+                 error_status=503,
+                 seed=0):
+        # pylint: disable-msg=too-many-arguments
+        super().__init__(address, StandinHandler)
+        if routes is None:
+            routes = synthetic_dataset()
+        self.routes = {}
+        for path, response in routes.items():
+            if not isinstance(response, bytes):
+                response = json.dumps(response).encode('utf-8')
+            self.routes[path] = response
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.thread = None
+
+    @property
+    def url(self):
+        """Base URL of the stand-in (use as API_HOST)"""
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def environment(self):
+        """Environment variables pointing isodbtools at the stand-in"""
+        return {
+            'ISODB_API_HOST': self.url,
+            'ISODB_DOI_HOST': self.url + DOI_PREFIX.rstrip('/')
+        }
+
+    def respond(self, path):
+        """Status and body for a request path"""
+        with self.lock:
+            delay = self.latency + self.jitter * self.random.random()
+            failed = self.random.random() < self.error_rate
+            self.counts['requests'] += 1
+            self.counts[route_name(path)] += 1
+            if failed:
+                self.counts['injected_errors'] += 1
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            return self.error_status, b'Injected error'
+        body = self.routes.get(path)
+        if body is None:
+            with self.lock:
+                self.counts['not_found'] += 1
+            return 404, b'Not Found'
+        return 200, body
+
+    def snapshot_counts(self):
+        """Copy of the request counters"""
+        with self.lock:
+            return dict(self.counts)
+
+    def start(self):
+        """Serve from a background thread; returns the server"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Shut the server down"""
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
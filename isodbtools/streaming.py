@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Module to provide incremental parsing of the large API listings
+"""
+import json
+import codecs
+import tempfile
+import functools
+
+from .config import TEXTENCODE
+from .http_client import get
+from .instrumentation import stage, count
+
+DECODER = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',]'
+
+
+def iter_json_array(chunks):
+    """Yield the elements of a JSON array from an iterable of byte chunks
+
+    Each element is decoded as soon as it has fully arrived, so memory is
+    bounded by the largest element rather than by the whole array.
+    """
+    # pylint: disable-msg=too-many-branches
+    text_decoder = codecs.getincrementaldecoder(TEXTENCODE)()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    started = False
+    finished = False
+    exhausted = False
+    while True:
+        # Skip whitespace and separators between elements
+        while position < len(buffer) and (buffer[position] in WHITESPACE or
+                                          (started
+                                           and buffer[position] == ',')):
+            position += 1
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Listing is not a JSON array')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                finished = True
+                break
+            try:
+                item, end = DECODER.raw_decode(buffer, position)
+            except ValueError:
+                if exhausted:
+                    raise
+                end = None
+            # An element is complete once a delimiter follows it; otherwise it
+            #  may be cut at a chunk boundary (e.g. "1500." + "0")
+            if end is not None and (exhausted or
+                                    (end < len(buffer)
+                                     and buffer[end] in DELIMITERS)):
+                yield item
+                position = end
+                continue
+        elif exhausted:
+            break
+        # Read more data, discarding what has been consumed
+        buffer = buffer[position:]
+        position = 0
+        try:
+            buffer += text_decoder.decode(next(chunks))
+        except StopIteration:
+            buffer += text_decoder.decode(b'', final=True)
+            exhausted = True
+    if not finished:
+        raise ValueError('Truncated JSON array listing')
+
+
+class ListingStream:
+    # pylint: disable-msg=too-few-public-methods
+    """Entries of a JSON array listing, decoded incrementally
+
+    The listing is first downloaded to a temporary file, so the connection is
+    not held open while the downloads it feeds run, and memory stays bounded
+    by the largest entry.
+    """
+    def __init__(self, url, headers=None, chunk_size=65536):
+        self.url = url
+        self.headers = headers
+        self.chunk_size = chunk_size
+        self.count = 0
+
+    def __iter__(self):
+        with tempfile.TemporaryFile() as spool:
+            self.spool(spool)
+            spool.seek(0)
+            for item in iter_json_array(
+                    iter(functools.partial(spool.read, self.chunk_size), b'')):
+                self.count += 1
+                yield item
+
+    def spool(self, output):
+        """Download the whole listing to a binary file object"""
+        with get(self.url, headers=self.headers, stream=True) as response:
+            for chunk in self.timed_chunks(
+                    response.iter_content(chunk_size=self.chunk_size)):
+                output.write(chunk)
+
+    @staticmethod
+    def timed_chunks(chunks):
+        """Pass the downloaded chunks through, timing the network reads"""
+        while True:
+            with stage('http_stream'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            count('http.bytes', len(chunk))
+            yield chunk
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Module to provide rate-limited, concurrent execution of API requests
+"""
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket:
+    # pylint: disable-msg=too-few-public-methods
+    """Token-bucket rate limiter shared by all threads issuing API requests
+
+    Tokens accumulate at `rate` per second up to `capacity`; each request
+    consumes one token and blocks while the bucket is empty.
+    """
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError('Rate limit must be positive: ' + str(rate))
+        self.rate = float(rate)
+        if capacity is None:
+            capacity = max(1.0, self.rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` requests may be issued"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_limiter(rate_limit):
+    """Return a TokenBucket for `rate_limit` requests/s (None disables the limit)"""
+    if not rate_limit:
+        return None
+    return TokenBucket(rate_limit)
+
+
+def run_tasks(task, items, workers=1, limiter=None):
+    """Apply `task` to every item on a pool of worker threads
+
+    Yields (item, result) pairs in input order. At most 2*workers tasks are
+    in flight, so `items` may be a lazy generator. Each call to `task`
+    consumes one token from `limiter` (if given). Exceptions raised by `task`
+    propagate to the caller.
+    """
+    def throttled(item):
+        if limiter is not None:
+            limiter.acquire()
+        return task(item)
+
+    if workers <= 1:
+        for item in items:
+            yield item, throttled(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append((item, pool.submit(throttled, item)))
+            if len(pending) >= 2 * workers:
+                item_done, future = pending.popleft()
+                yield item_done, future.result()
+        while pending:
+            item_done, future = pending.popleft()
+            yield item_done, future.result()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Module to provide the unit registry for pressure and adsorption units
+
+The registry is compiled once from the API reference snapshot and the
+conversion tables in config into hashed lookups, so units are translated and
+converted without any API request or table scan. Pressure units are matched
+exactly (e.g. 'MPa' and 'mPa' differ); adsorption unit names, as in the API
+lookup tables, case-insensitively.
+"""
+import numpy as np
+
+from .config import pressure_units, adsorption_units, adsorption_mass_units
+from .reference_maps import reference_snapshot
+
+# pylint: disable=consider-using-f-string
+
+# Registry compiled from the current snapshot (see unit_registry)
+REGISTRY = {}
+
+
+class UnitRegistry:
+    """Lookups and conversion factors of the ISODB units
+
+    Pressure factors convert to bar. Adsorption units are mapped to the ISODB
+    default spelling (API lookup tables), and factors convert to mmol/g.
+    """
+    def __init__(self, snapshot=None):
+        self.pressure = dict(pressure_units)
+        self.amount = {
+            name.lower(): factor
+            for name, factor in adsorption_units.items()
+        }
+        self.mass = {
+            name.lower(): factor
+            for name, factor in adsorption_mass_units.items()
+        }
+        # input name -> ID -> default name
+        self.defaults = {}
+        if snapshot is not None:
+            default_names = {
+                x['id']: x['name']
+                for x in snapshot['adsorption_units']['default']
+            }
+            for item in snapshot['adsorption_units']['all']:
+                if item['id'] in default_names:
+                    self.defaults[item['name'].lower()] = default_names[
+                        item['id']]
+
+    def pressure_factor(self, units):
+        """Factor converting pressures in `units` to bar"""
+        try:
+            return self.pressure[units]
+        except (KeyError, TypeError) as error_handler:
+            raise ValueError('Unknown pressure units: %r' %
+                             (units, )) from error_handler
+
+    def default_adsorption_units(self, units):
+        """ISODB default name of adsorption `units`"""
+        try:
+            return self.defaults[units.lower()]
+        except (KeyError, AttributeError) as error_handler:
+            raise ValueError('Unknown adsorption units: %r' %
+                             (units, )) from error_handler
+
+    def adsorption_factor(self, units, molar_mass=None):
+        """Factor converting adsorption in `units` to mmol/g
+
+        Units per mass of adsorbate (e.g. mg/g) need the adsorbate molar
+        mass (g/mol).
+        """
+        key = self.defaults.get(units.lower(), units).lower()
+        if key in self.amount:
+            return self.amount[key]
+        if key in self.mass:
+            if molar_mass is None:
+                raise ValueError('Adsorption units %r need the molar mass' %
+                                 (units, ))
+            return self.mass[key] / molar_mass
+        raise ValueError('No conversion of adsorption units %r' % (units, ))
+
+    def convert_adsorption(self, values, units, molar_mass=None):
+        """Convert an array (or column) of adsorption values to mmol/g"""
+        return np.asarray(values, dtype=float) * self.adsorption_factor(
+            units, molar_mass)
+
+
+def unit_registry():
+    """The registry of the current API reference snapshot (compiled once)"""
+    snapshot = reference_snapshot()
+    revision = snapshot.get('revision')
+    if REGISTRY.get('revision') != revision or 'units' not in REGISTRY:
+        REGISTRY['units'] = UnitRegistry(snapshot)
+        REGISTRY['revision'] = revision
+    return REGISTRY['units']
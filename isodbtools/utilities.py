@@ -2,21 +2,65 @@
 # -*- coding: utf-8 -*-
 # pylint: disable-msg=line-too-long
 """Module to execute operations related to ISODB data handling"""
+import sys
+import time
+import cProfile
 import click
 import git
 
-from .config import API_HOST, SCRIPT_PATH, canonical_keys, clean_json
+from .config import API_HOST, SCRIPT_PATH, JSON_FOLDER, COLUMNAR_FOLDER, API_RATE_LIMIT, API_WORKERS, REGENERATE_PRIORITIES, canonical_keys, clean_json_tree, json_writer
+from .reference_maps import refresh_maps
 from .bibliography_operations import generate_bibliography, regenerate_bibliography
 from .adsorbents_operations import regenerate_adsorbents
 from .adsorbates_operations import regenerate_adsorbates
-from .isotherm_operations import download_isotherm, regenerate_isotherm_library, post_process
+from .library_index import index_library
+from .scheduler import regenerate_all
+from .columnar import export_columnar
+from .interpolation import query_uptake
+from .duplicates import find_duplicates
+from .standin import StandinServer, synthetic_dataset, load_recordings
+from .benchmark import BENCHMARK_COMMANDS, run_benchmark
+from .instrumentation import profile_report
+from .validation import validate
+from .isotherm_operations import download_isotherm, regenerate_isotherm_library, post_process, \
+    post_process_batch, sync_library
 
 
 @click.group()
-def cli():
-    # pylint: disable=unnecessary-pass
+@click.option('--profile',
+              'profile_path',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Write a JSON report of stage timers and counters')
+@click.option('--cprofile',
+              'cprofile_path',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Write a cProfile dump (pstats format)')
+@click.pass_context
+def cli(ctx, profile_path, cprofile_path):
     """Master for click"""
-    pass
+    started = time.time()
+    start = time.perf_counter()
+    profiler = None
+    if cprofile_path is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def write_profile():
+        """Write the requested reports when the command finishes"""
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        if profile_path is not None:
+            report = profile_report(time.perf_counter() - start)
+            report['command'] = ctx.invoked_subcommand
+            report['arguments'] = sys.argv[1:]
+            report['started'] = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                              time.gmtime(started))
+            json_writer(profile_path, report)
+
+    ctx.call_on_close(write_profile)
 
 
 @cli.command('tester')
@@ -28,10 +72,22 @@ def tester_fcn():
 
 
 @cli.command('clean_json')
-@click.argument('filename', type=click.Path(exists=True), nargs=1)
-def clean_json_runner(filename):
-    """Run the clean json function"""
-    clean_json(filename)
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--workers',
+              type=int,
+              default=None,
+              help='Worker processes (default: one per CPU)')
+def clean_json_runner(paths, workers):
+    """Run the clean json function on files, folders or glob patterns"""
+    clean_json_tree(paths, workers=workers)
+
+
+@cli.command('refresh_maps')
+def refresh_maps_runner():
+    """Download the API reference maps to the offline snapshot"""
+    snapshot = refresh_maps()
+    print('Saved API reference snapshot revision', snapshot['revision'],
+          'from', snapshot['api_host'])
 
 
 @cli.command('download_isotherm')
@@ -41,28 +97,320 @@ def download_isotherm_runner(isotherm):
     download_isotherm(isotherm)
 
 
+def download_options(function):
+    """Options shared by the library regeneration commands"""
+    function = click.option(
+        '--resume',
+        is_flag=True,
+        help='Skip items completed by a previous run (see manifest)')(function)
+    function = click.option(
+        '--rate-limit',
+        type=float,
+        default=API_RATE_LIMIT,
+        show_default=True,
+        help='API requests per second (0 = unlimited)')(function)
+    function = click.option('--workers',
+                            type=int,
+                            default=API_WORKERS,
+                            show_default=True,
+                            help='Concurrent download threads')(function)
+    return function
+
+
 @cli.command('regenerate_library')
-def regenerate_isotherm_library_runner():
+@download_options
+def regenerate_isotherm_library_runner(workers, rate_limit, resume):
     """Run the regenerate_isotherm_library function"""
-    regenerate_isotherm_library()
+    regenerate_isotherm_library(workers=workers,
+                                rate_limit=rate_limit,
+                                resume=resume)
+
+
+def parse_priorities(ctx, param, values):
+    # pylint: disable-msg=unused-argument
+    """Parse the RESOURCE=SHARE values of --priority into a dictionary"""
+    shares = {}
+    for value in values:
+        name, _, share = value.partition('=')
+        if name not in REGENERATE_PRIORITIES:
+            raise click.BadParameter(value + ': resource must be one of ' +
+                                     ', '.join(sorted(REGENERATE_PRIORITIES)))
+        try:
+            shares[name] = int(share)
+        except ValueError as error_handler:
+            raise click.BadParameter(
+                value + ': share must be an integer') from error_handler
+        if shares[name] < 1:
+            raise click.BadParameter(value + ': share must be at least 1')
+    return shares
+
+
+@cli.command('regenerate_all')
+@download_options
+@click.option('--priority',
+              'priorities',
+              multiple=True,
+              metavar='RESOURCE=SHARE',
+              callback=parse_priorities,
+              help='Tasks per scheduling round for adsorbates, adsorbents, '
+              'bibliography or isotherms (repeatable)')
+def regenerate_all_runner(workers, rate_limit, resume, priorities):
+    """Regenerate all library resources under one request budget"""
+    regenerate_all(workers=workers,
+                   rate_limit=rate_limit,
+                   resume=resume,
+                   priorities=priorities)
+
+
+@cli.command('sync_library')
+@click.option('--workers',
+              type=int,
+              default=API_WORKERS,
+              show_default=True,
+              help='Concurrent download threads')
+@click.option('--rate-limit',
+              type=float,
+              default=API_RATE_LIMIT,
+              show_default=True,
+              help='API requests per second (0 = unlimited)')
+@click.option('--withdrawn',
+              type=click.Choice(['keep', 'quarantine', 'remove']),
+              default='keep',
+              show_default=True,
+              help='What to do with isotherms withdrawn upstream')
+@click.option('--dry-run', is_flag=True, help='Report the diff only')
+@click.option('--report',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Write the diff as JSON')
+def sync_library_runner(workers, rate_limit, withdrawn, dry_run, report):
+    # pylint: disable-msg=too-many-arguments
+    """Download new isotherms and handle withdrawn ones (delta sync)"""
+    diff = sync_library(workers=workers,
+                        rate_limit=rate_limit,
+                        withdrawn=withdrawn,
+                        dry_run=dry_run)
+    if report is not None:
+        json_writer(report, diff)
 
 
 @cli.command('regenerate_adsorbents')
-def regenerate_adsorbents_runner():
+@download_options
+def regenerate_adsorbents_runner(workers, rate_limit, resume):
     """Run the regenerate adsorbents function"""
-    regenerate_adsorbents()
+    regenerate_adsorbents(workers=workers,
+                          rate_limit=rate_limit,
+                          resume=resume)
 
 
 @cli.command('regenerate_adsorbates')
-def regenerate_adsorbates_runner():
+@download_options
+def regenerate_adsorbates_runner(workers, rate_limit, resume):
     """Run the regenerate adsorbates function"""
-    regenerate_adsorbates()
+    regenerate_adsorbates(workers=workers,
+                          rate_limit=rate_limit,
+                          resume=resume)
 
 
 @cli.command('regenerate_bibliography')
-def regenerate_bibliography_runner():
+@download_options
+def regenerate_bibliography_runner(workers, rate_limit, resume):
     """Run the regenerate bibliography function"""
-    regenerate_bibliography()
+    regenerate_bibliography(workers=workers,
+                            rate_limit=rate_limit,
+                            resume=resume)
+
+
+@cli.command('index_library')
+@click.option('--folder',
+              type=click.Path(exists=True, file_okay=False),
+              default=JSON_FOLDER,
+              help='Library folder')
+@click.option(
+    '--index',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='Index database (default: library_index.sqlite in the folder)')
+def index_library_runner(folder, index):
+    """Build or update the SQLite index of the isotherm library"""
+    index_library(folder=folder, path=index)
+
+
+@cli.command('export_columnar')
+@click.option('--folder',
+              type=click.Path(exists=True, file_okay=False),
+              default=JSON_FOLDER,
+              help='Library folder')
+@click.option('--output',
+              type=click.Path(file_okay=False),
+              default=COLUMNAR_FOLDER,
+              help='Export folder')
+def export_columnar_runner(folder, output):
+    """Export all isotherm points as memory-mappable NumPy arrays"""
+    export_columnar(folder=folder, output=output)
+
+
+@cli.command('query_uptake')
+@click.option('--pressure',
+              'pressures',
+              type=float,
+              multiple=True,
+              required=True,
+              help='Target pressure in bar (repeat for several)')
+@click.option('--adsorbate',
+              default=None,
+              help='InChIKey, name, formula or synonym (e.g. CO2)')
+@click.option('--adsorbent', default=None, help='Adsorbent hashkey')
+@click.option('--temperature',
+              type=float,
+              default=None,
+              help='Temperature (K)')
+@click.option('--tolerance',
+              type=float,
+              default=0.5,
+              show_default=True,
+              help='Temperature tolerance (K)')
+@click.option('--category', default=None, help='e.g. exp, sim')
+@click.option('--log-pressure',
+              is_flag=True,
+              help='Interpolate linearly in log10(pressure)')
+@click.option('--mmol-g',
+              'convert_units',
+              is_flag=True,
+              help='Convert adsorption to mmol/g')
+@click.option('--folder',
+              type=click.Path(exists=True, file_okay=False),
+              default=JSON_FOLDER,
+              help='Library folder')
+@click.option('--report',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Write the results as JSON')
+def query_uptake_runner(pressures, adsorbate, adsorbent, temperature,
+                        tolerance, category, log_pressure, convert_units,
+                        folder, report):
+    # pylint: disable-msg=too-many-arguments
+    """Interpolate the adsorption of every matching isotherm at given pressures"""
+    rows = query_uptake(pressures,
+                        folder=folder,
+                        log_pressure=log_pressure,
+                        convert_units=convert_units,
+                        report=report,
+                        adsorbate=adsorbate,
+                        adsorbent=adsorbent,
+                        temperature=temperature,
+                        temperature_tolerance=tolerance,
+                        category=category)
+    for row in rows:
+        print(row['filename'], row['adsorbate'], row['adsorbent_name'],
+              row['temperature'], row['units'], row['uptake'])
+
+
+@cli.command('find_duplicates')
+@click.option('--folder',
+              type=click.Path(exists=True, file_okay=False),
+              default=JSON_FOLDER,
+              help='Library folder')
+@click.option('--tolerance',
+              type=float,
+              default=0.02,
+              show_default=True,
+              help='Relative RMS difference of near-duplicates')
+@click.option('--report',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Write the duplicates as JSON')
+def find_duplicates_runner(folder, tolerance, report):
+    """Find exact and near-duplicate isotherms in the library"""
+    find_duplicates(folder=folder, tolerance=tolerance, report=report)
+
+
+def standin_options(function):
+    """Options shared by the API stand-in commands"""
+    function = click.option(
+        '--error-rate',
+        type=float,
+        default=0.0,
+        show_default=True,
+        help='Fraction of requests answered with HTTP 503')(function)
+    function = click.option('--jitter',
+                            type=float,
+                            default=0.0,
+                            show_default=True,
+                            help='Random extra latency, up to (s)')(function)
+    function = click.option(
+        '--latency',
+        type=float,
+        default=0.01,
+        show_default=True,
+        help='Latency added to every response (s)')(function)
+    function = click.option(
+        '--biblios',
+        type=int,
+        default=50,
+        show_default=True,
+        help='Synthetic bibliography entries (4 isotherms each)')(function)
+    return function
+
+
+@cli.command('serve_api')
+@standin_options
+@click.option('--port', type=int, default=8000, show_default=True)
+@click.option('--recordings',
+              type=click.Path(exists=True, file_okay=False),
+              default=None,
+              help='Folder of recorded responses, served by path')
+def serve_api_runner(biblios, latency, jitter, error_rate, port, recordings):
+    # pylint: disable-msg=too-many-arguments
+    """Serve a local stand-in of the ISODB API and doi.org"""
+    routes = synthetic_dataset(biblios=biblios)
+    if recordings is not None:
+        routes.update(load_recordings(recordings))
+    server = StandinServer(routes,
+                           address=('127.0.0.1', port),
+                           latency=latency,
+                           jitter=jitter,
+                           error_rate=error_rate)
+    with server:
+        print('API stand-in listening; point isodbtools at it with:')
+        for key, value in server.environment().items():
+            print('  export ' + key + '=' + value)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    print(server.snapshot_counts())
+
+
+@cli.command('benchmark')
+@standin_options
+@click.option('--workers', type=int, default=4, show_default=True)
+@click.option('--command',
+              'commands',
+              multiple=True,
+              type=click.Choice([x[0] for x in BENCHMARK_COMMANDS]),
+              help='Command to benchmark (repeatable; default: all)')
+@click.option('--workdir',
+              type=click.Path(file_okay=False),
+              default=None,
+              help='Keep the scratch folder here')
+@click.option('--report',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Write a JSON report')
+def benchmark_runner(biblios, latency, jitter, error_rate, workers, commands,
+                     workdir, report):
+    # pylint: disable-msg=too-many-arguments
+    """Benchmark the library commands against the local API stand-in"""
+    run_benchmark(commands=commands or None,
+                  workers=workers,
+                  latency=latency,
+                  jitter=jitter,
+                  error_rate=error_rate,
+                  dataset=synthetic_dataset(biblios=biblios),
+                  workdir=workdir,
+                  report=report)
 
 
 @cli.command('git_log')
@@ -82,6 +430,34 @@ def post_process_isotherm_runner(filename):
     post_process(filename)
 
 
+@cli.command('post_process_batch')
+@click.argument('pattern', nargs=1)
+@click.option('--workers',
+              type=int,
+              default=None,
+              help='Worker processes (default: one per CPU)')
+def post_process_batch_runner(pattern, workers):
+    """Run the post_process function on a folder or glob of isotherms"""
+    post_process_batch(pattern, workers=workers)
+
+
+@cli.command('validate')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--workers',
+              type=int,
+              default=None,
+              help='Worker processes (default: one per CPU)')
+@click.option('--report',
+              type=click.Path(),
+              default=None,
+              help='Write the issues of every file as JSON')
+def validate_runner(paths, workers, report):
+    """Validate isotherm files, folders or globs offline; exits 1 on errors"""
+    result = validate(paths, workers=workers, report=report)
+    if result['summary']['with_errors']:
+        sys.exit(1)
+
+
 # To Do:
 # Post-Process Script:
 #   Do we want to deal with partial-pressure in the isotherm_data block ?
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""Module to provide offline batch validation of isotherm submissions
+
+Every file is checked against the whole rule set (keys, types, vocabulary,
+units, species and point structure) and all problems are reported at once.
+No API requests are made: vocabularies come from the reference snapshot,
+known entities from the mirrored Adsorbates/Adsorbents folders and names
+from the local resolver cache.
+"""
+import os
+import re
+import json
+import numbers
+import collections
+import multiprocessing
+
+from .config import JSON_FOLDER, canonical_keys, expand_json_paths, json_writer
+from .reference_maps import reference_snapshot
+from .units import UnitRegistry
+from .adsorbates_operations import ADSORBATE_RESOLVER
+from .adsorbents_operations import ADSORBENT_RESOLVER
+
+# pylint: disable=consider-using-f-string
+
+INCHIKEY = re.compile(r'^[A-Z]{14}-[A-Z]{10}-[A-Z]$')
+# post_process assigns 'filename'; the other canonical keys are required
+REQUIRED_KEYS = [x for x in canonical_keys if x != 'filename']
+# Keys read by post_process besides the canonical keys
+OPTIONAL_KEYS = ('saturationPressure', 'log_scale')
+FIELD_TYPES = {
+    'DOI': str,
+    'adsorbates': list,
+    'adsorbent': dict,
+    'adsorptionUnits': str,
+    'articleSource': str,
+    'category': str,
+    'compositionType': str,
+    'concentrationUnits': str,
+    'date': str,
+    'digitizer': str,
+    'filename': str,
+    'isotherm_data': list,
+    'isotherm_type': str,
+    'pressureUnits': str,
+}
+# Fields post_process accepts as null (written as '')
+NULLABLE_KEYS = ('articleSource', 'date', 'digitizer')
+MAX_POINT_ISSUES = 20  # point-level issues reported per rule and file
+
+# Rule set of the worker processes (see init_validate_worker)
+VALIDATION_RULES = {}
+
+
+def is_number(value):
+    """Check for a real number (booleans excluded)"""
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def known_keys(folder):
+    """Keys (file names) of the entities mirrored in a Library subfolder"""
+    if not os.path.isdir(folder):
+        return None
+    return {x[:-5] for x in os.listdir(folder) if x.endswith('.json')}
+
+
+def validation_tables(folder=JSON_FOLDER):
+    """Reference tables for the rule set, all read from local files"""
+    return {
+        'snapshot': reference_snapshot(offline=True),
+        'adsorbates': known_keys(os.path.join(folder, 'Adsorbates')),
+        'adsorbents': known_keys(os.path.join(folder, 'Adsorbents'))
+    }
+
+
+class RuleSet:
+    """Validation rules compiled against the reference tables
+
+    `check(isotherm)` returns a list of issues, each a dictionary with the
+    severity ('error' or 'warning'), rule, path and message.
+    """
+    def __init__(self, tables):
+        snapshot = tables['snapshot']
+        self.adsorbates = tables['adsorbates']
+        self.adsorbents = tables['adsorbents']
+        # Vocabulary: lowercase API name -> shortname, and the shortnames
+        self.names = {}
+        self.shortnames = {}
+        self.units = UnitRegistry(snapshot)
+        self.snapshot = snapshot is not None
+        if snapshot is not None:
+            for key, table in snapshot['maps'].items():
+                self.names[key] = {
+                    x['name'].lower(): x['shortname']
+                    for x in table
+                }
+                self.shortnames[key] = {x['shortname'] for x in table}
+        self.rules = [
+            self.check_keys, self.check_types, self.check_vocabulary,
+            self.check_units, self.check_species, self.check_points
+        ]
+
+    def check(self, isotherm):
+        """All the issues of an isotherm"""
+        if not isinstance(isotherm, dict):
+            return [issue('error', 'structure', '', 'not a JSON object')]
+        issues = []
+        for rule in self.rules:
+            issues += rule(isotherm)
+        return issues
+
+    @staticmethod
+    def check_keys(isotherm):
+        """Required canonical keys, and keys post_process would drop"""
+        issues = []
+        for key in REQUIRED_KEYS:
+            if key not in isotherm:
+                issues.append(
+                    issue('error', 'missing_key', key, 'required key missing'))
+        for key in isotherm:
+            if key not in canonical_keys and key not in OPTIONAL_KEYS:
+                issues.append(
+                    issue('warning', 'unknown_key', key,
+                          'not a canonical key; dropped by post_process'))
+        return issues
+
+    @staticmethod
+    def check_types(isotherm):
+        """Types of the top-level fields"""
+        issues = []
+        for key, kind in FIELD_TYPES.items():
+            if key not in isotherm:
+                continue
+            value = isotherm[key]
+            if value is None and key in NULLABLE_KEYS:
+                continue
+            if not isinstance(value, kind):
+                issues.append(
+                    issue(
+                        'error', 'type', key, 'expected ' + kind.__name__ +
+                        ', found ' + type(value).__name__))
+        if 'temperature' in isotherm:
+            if not is_number(isotherm['temperature']):
+                issues.append(
+                    issue('error', 'type', 'temperature',
+                          'expected a number (K)'))
+            elif isotherm['temperature'] <= 0:
+                issues.append(
+                    issue('error', 'temperature', 'temperature',
+                          'must be positive (K)'))
+        tabular_data = isotherm.get('tabular_data', 0)
+        if not isinstance(tabular_data, int) or tabular_data not in (0, 1):
+            issues.append(
+                issue('error', 'tabular_data', 'tabular_data',
+                      'must be 0, 1, false or true'))
+        if 'log_scale' in isotherm and not isinstance(isotherm['log_scale'],
+                                                      bool):
+            issues.append(
+                issue('error', 'type', 'log_scale', 'expected a boolean'))
+        return issues
+
+    def check_vocabulary(self, isotherm):
+        """Mapped fields must match an API name or shortname"""
+        if not self.names:
+            return [
+                issue(
+                    'warning', 'offline_snapshot', '',
+                    'no API reference snapshot; vocabulary checks skipped '
+                    '(run refresh_maps)')
+            ]
+        issues = []
+        for key, names in self.names.items():
+            value = isotherm.get(key)
+            if key == 'pressureUnits' or not isinstance(value, str):
+                continue  # pressure units: see check_units
+            if names.get(value.lower(), value) not in self.shortnames[key]:
+                issues.append(
+                    issue('error', 'vocabulary', key,
+                          'unknown value ' + repr(value)))
+        return issues
+
+    def check_units(self, isotherm):
+        """Pressure units (and saturation pressure) and adsorption units"""
+        issues = []
+        units = isotherm.get('pressureUnits')
+        if isinstance(units, str):
+            units = self.names.get('pressureUnits',
+                                   {}).get(units.lower(), units)
+            if units == 'RELATIVE':
+                try:
+                    if float(isotherm['saturationPressure']) <= 0:
+                        raise ValueError
+                except (KeyError, TypeError, ValueError):
+                    issues.append(
+                        issue(
+                            'error', 'saturation_pressure',
+                            'saturationPressure',
+                            'RELATIVE pressure units need a positive '
+                            'saturationPressure (bar)'))
+            else:
+                try:
+                    self.units.pressure_factor(units)
+                except ValueError as error_handler:
+                    issues.append(
+                        issue('error', 'pressure_units', 'pressureUnits',
+                              str(error_handler)))
+        units = isotherm.get('adsorptionUnits')
+        if isinstance(units, str) and self.snapshot:
+            try:
+                self.units.default_adsorption_units(units)
+            except ValueError as error_handler:
+                issues.append(
+                    issue('error', 'adsorption_units', 'adsorptionUnits',
+                          str(error_handler)))
+        return issues
+
+    def check_entity(self, entity, path, key, known, resolver):
+        # pylint: disable-msg=too-many-arguments
+        # pylint: disable-msg=too-many-return-statements
+        """Adsorbate/adsorbent identified by key (e.g. InChIKey) or by name"""
+        if not isinstance(entity, dict):
+            return [issue('error', 'type', path, 'expected an object')]
+        if key in entity:
+            value = entity[key]
+            if key == 'InChIKey' and not (isinstance(value, str)
+                                          and INCHIKEY.match(value)):
+                return [
+                    issue('error', 'species', path + '.' + key,
+                          'malformed InChIKey ' + repr(value))
+                ]
+            if known is not None and value not in known:
+                return [
+                    issue('error', 'species', path + '.' + key,
+                          'not in the ISODB: ' + repr(value))
+                ]
+            return []
+        if not isinstance(entity.get('name'), str):
+            return [
+                issue('error', 'species', path,
+                      'needs a ' + key + ' or a name')
+            ]
+        found, value = resolver.peek(entity['name'])
+        if not found:
+            return [
+                issue(
+                    'warning', 'unverified_name', path + '.name',
+                    repr(entity['name']) + ' is not in the local name cache;'
+                    ' resolved by post_process through the API')
+            ]
+        if value is None:
+            return [
+                issue('error', 'species', path + '.name',
+                      'unknown name ' + repr(entity['name']))
+            ]
+        return []
+
+    def declared_species(self, isotherm):
+        """InChIKeys and lowercase names the points may refer to"""
+        declared = set()
+        adsorbates = isotherm.get('adsorbates')
+        for adsorbate in adsorbates if isinstance(adsorbates, list) else []:
+            if not isinstance(adsorbate, dict):
+                continue
+            if isinstance(adsorbate.get('InChIKey'), str):
+                declared.add(adsorbate['InChIKey'])
+            if isinstance(adsorbate.get('name'), str):
+                declared.add(adsorbate['name'].lower())
+                found, value = ADSORBATE_RESOLVER.peek(adsorbate['name'])
+                if found and value is not None:
+                    declared.add(value['InChIKey'])
+        return declared
+
+    def check_species(self, isotherm):
+        """Adsorbates and adsorbent must be identifiable"""
+        issues = []
+        adsorbates = isotherm.get('adsorbates')
+        if isinstance(adsorbates, list):
+            if not adsorbates:
+                issues.append(
+                    issue('error', 'species', 'adsorbates',
+                          'no adsorbates declared'))
+            for (i, adsorbate) in enumerate(adsorbates):
+                issues += self.check_entity(adsorbate, 'adsorbates[%d]' % i,
+                                            'InChIKey', self.adsorbates,
+                                            ADSORBATE_RESOLVER)
+        if isinstance(isotherm.get('adsorbent'), dict):
+            issues += self.check_entity(isotherm['adsorbent'], 'adsorbent',
+                                        'hashkey', self.adsorbents,
+                                        ADSORBENT_RESOLVER)
+        return issues
+
+    def check_points(self, isotherm):
+        # pylint: disable-msg=too-many-branches
+        # pylint: disable-msg=too-many-locals
+        """Structure and values of the isotherm points"""
+        points = isotherm.get('isotherm_data')
+        if not isinstance(points, list):
+            return []
+        if not points:
+            return [
+                issue('error', 'points', 'isotherm_data', 'no data points')
+            ]
+        declared = self.declared_species(isotherm)
+        log_scale = isotherm.get('log_scale') is True
+        issues = collections.defaultdict(list)
+        for (i, point) in enumerate(points):
+            path = 'isotherm_data[%d]' % i
+            if not isinstance(point, dict):
+                issues['points'].append(
+                    issue('error', 'points', path, 'expected an object'))
+                continue
+            if not is_number(point.get('pressure')):
+                issues['points'].append(
+                    issue('error', 'points', path + '.pressure',
+                          'missing or non-numeric pressure'))
+            elif point['pressure'] < 0 and not log_scale:
+                issues['negative_value'].append(
+                    issue(
+                        'warning', 'negative_value', path + '.pressure',
+                        'negative pressure; point dropped by '
+                        'post_process'))
+            species_data = point.get('species_data')
+            if not isinstance(species_data, list) or not species_data:
+                issues['points'].append(
+                    issue('error', 'points', path + '.species_data',
+                          'missing or empty species_data'))
+                continue
+            seen = set()
+            for (j, species) in enumerate(species_data):
+                species_path = path + '.species_data[%d]' % j
+                if not isinstance(species, dict):
+                    issues['points'].append(
+                        issue('error', 'points', species_path,
+                              'expected an object'))
+                    continue
+                key = species.get('InChIKey', species.get('name'))
+                if not isinstance(key, str):
+                    issues['points'].append(
+                        issue('error', 'points', species_path,
+                              'needs an InChIKey or a name'))
+                elif key in seen:
+                    issues['points'].append(
+                        issue('error', 'points', species_path,
+                              'species repeated in the point'))
+                elif key not in declared and key.lower() not in declared:
+                    issues['undeclared_species'].append(
+                        issue('error', 'undeclared_species', species_path,
+                              repr(key) + ' is not a declared adsorbate'))
+                seen.add(key)
+                if not is_number(species.get('adsorption')):
+                    issues['points'].append(
+                        issue('error', 'points', species_path + '.adsorption',
+                              'missing or non-numeric adsorption'))
+                elif species['adsorption'] < 0:
+                    issues['negative_value'].append(
+                        issue(
+                            'warning', 'negative_value',
+                            species_path + '.adsorption',
+                            'negative adsorption; point dropped by '
+                            'post_process'))
+        # Cap the point-level issues of each rule
+        capped = []
+        for rule, found in issues.items():
+            capped += found[:MAX_POINT_ISSUES]
+            if len(found) > MAX_POINT_ISSUES:
+                capped.append(
+                    issue(
+                        found[0]['severity'], rule, 'isotherm_data',
+                        str(len(found) - MAX_POINT_ISSUES) +
+                        ' more issues not shown'))
+        return capped
+
+
+def issue(severity, rule, path, message):
+    """A validation issue"""
+    return {
+        'severity': severity,
+        'rule': rule,
+        'path': path,
+        'message': message
+    }
+
+
+def init_validate_worker(tables):
+    """Compile the rule set once per worker process"""
+    VALIDATION_RULES['rules'] = RuleSet(tables)
+
+
+def validate_file(filename):
+    """Validate one file; returns (filename, issues)"""
+    try:
+        with open(filename, mode='r', encoding='utf-8') as handle:
+            isotherm = json.load(handle)
+    except (OSError, ValueError) as error_handler:
+        return filename, [issue('error', 'json', '', str(error_handler))]
+    return filename, VALIDATION_RULES['rules'].check(isotherm)
+
+
+def validate(paths, workers=None, report=None):
+    # pylint: disable-msg=too-many-locals
+    """Validate isotherm files, folders or glob patterns, offline and in parallel
+
+    Returns the report: the issues of each file, plus a summary. With
+    `report`, it is also written as JSON.
+    """
+    filenames = expand_json_paths(paths)
+    tables = validation_tables()
+    if workers == 1 or len(filenames) <= 1:
+        init_validate_worker(tables)
+        results = map(validate_file, filenames)
+        files = dict(results)
+    else:
+        with multiprocessing.Pool(workers,
+                                  initializer=init_validate_worker,
+                                  initargs=(tables, )) as pool:
+            files = dict(pool.imap(validate_file, filenames, chunksize=16))
+
+    # Summary
+    rules = collections.Counter()
+    with_errors = 0
+    with_warnings = 0
+    for filename, issues in files.items():
+        severities = {x['severity'] for x in issues}
+        with_errors += 'error' in severities
+        with_warnings += 'warning' in severities
+        rules.update(x['rule'] for x in issues)
+        for found in issues:
+            print(found['severity'].upper() + ':', filename, found['path'],
+                  found['message'])
+    summary = {
+        'files': len(files),
+        'valid': len(files) - with_errors,
+        'with_errors': with_errors,
+        'with_warnings': with_warnings,
+        'issues_by_rule': dict(sorted(rules.items()))
+    }
+    print(summary['files'], 'files,', summary['valid'], 'valid,', with_errors,
+          'with errors,', with_warnings, 'with warnings')
+    result = {'summary': summary, 'files': files}
+    if report is not None:
+        json_writer(report, result)
+    return result